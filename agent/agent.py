@@ -22,6 +22,7 @@ from llms import (
     generate_from_openai_completion,
     lm_config,
 )
+from llms.dispatcher import LLMDispatcher
 from llms.tokenizers import Tokenizer
 
 
@@ -37,6 +38,12 @@ class Agent:
         """Predict the next action given the observation"""
         raise NotImplementedError
 
+    def next_actions(
+        self, trajectory: Trajectory, intent: str, meta_data: Any
+    ) -> list[Action]:
+        """Predict the next actions to execute back to back"""
+        return [self.next_action(trajectory, intent, meta_data)]
+
     def reset(
         self,
         test_config_file: str,
@@ -106,66 +113,95 @@ class PromptAgent(Agent):
         action_set_tag: str,
         lm_config: lm_config.LMConfig,
         prompt_constructor: PromptConstructor,
+        llm_dispatcher: LLMDispatcher | None = None,
     ) -> None:
         super().__init__()
         self.lm_config = lm_config
         self.prompt_constructor = prompt_constructor
         self.action_set_tag = action_set_tag
+        # share the rate limit with the agents of the other trajectories
+        self.llm_dispatcher = llm_dispatcher
 
     def set_action_set_tag(self, tag: str) -> None:
         self.action_set_tag = tag
 
+    def create_action(self, parsed_response: str) -> Action:
+        if self.action_set_tag == "id_accessibility_tree":
+            return create_id_based_action(parsed_response)
+        elif self.action_set_tag == "playwright":
+            return create_playwright_action(parsed_response)
+        else:
+            raise ValueError(f"Unknown action type {self.action_set_tag}")
+
     @beartype
     def next_action(
         self, trajectory: Trajectory, intent: str, meta_data: dict[str, Any]
     ) -> Action:
+        return self.next_actions(trajectory, intent, meta_data)[0]
+
+    @beartype
+    def next_actions(
+        self, trajectory: Trajectory, intent: str, meta_data: dict[str, Any]
+    ) -> list[Action]:
+        """In action chunk mode, the response can hold up to
+        `action_chunk_size` actions, those after an unparsable one are
+        dropped"""
         prompt = self.prompt_constructor.construct(
             trajectory, intent, meta_data
         )
         lm_config = self.lm_config
+        action_chunk_size = lm_config.gen_config.get("action_chunk_size", 1)
         n = 0
         while True:
-            response = call_llm(lm_config, prompt)
+            if self.llm_dispatcher is not None:
+                response = self.llm_dispatcher.call(lm_config, prompt)
+            else:
+                response = call_llm(lm_config, prompt)
             force_prefix = self.prompt_constructor.instruction[
                 "meta_data"
             ].get("force_prefix", "")
             response = f"{force_prefix}{response}"
             n += 1
             try:
-                parsed_response = self.prompt_constructor.extract_action(
-                    response
+                parsed_responses = self.prompt_constructor.extract_actions(
+                    response, action_chunk_size
                 )
-                if self.action_set_tag == "id_accessibility_tree":
-                    action = create_id_based_action(parsed_response)
-                elif self.action_set_tag == "playwright":
-                    action = create_playwright_action(parsed_response)
-                else:
-                    raise ValueError(
-                        f"Unknown action type {self.action_set_tag}"
-                    )
-                action["raw_prediction"] = response
+                actions: list[Action] = []
+                for parsed_response in parsed_responses:
+                    try:
+                        action = self.create_action(parsed_response)
+                    except ActionParsingError:
+                        if not actions:
+                            raise
+                        break
+                    action["raw_prediction"] = response
+                    actions.append(action)
                 break
             except ActionParsingError as e:
                 if n >= lm_config.gen_config["max_retry"]:
                     action = create_none_action()
                     action["raw_prediction"] = response
+                    actions = [action]
                     break
 
-        return action
+        return actions
 
     def reset(self, test_config_file: str) -> None:
         pass
 
 
-def construct_agent(args: argparse.Namespace) -> Agent:
+def construct_agent(
+    args: argparse.Namespace, llm_dispatcher: LLMDispatcher | None = None
+) -> Agent:
     llm_config = lm_config.construct_llm_config(args)
 
     agent: Agent
     if args.agent_type == "teacher_forcing":
         agent = TeacherForcingAgent()
     elif args.agent_type == "prompt":
-        with open(args.instruction_path) as f:
-            constructor_type = json.load(f)["meta_data"]["prompt_constructor"]
+        constructor_type = load_instruction(args.instruction_path)[
+            "meta_data"
+        ]["prompt_constructor"]
         tokenizer = Tokenizer(args.provider, args.model)
         prompt_constructor = eval(constructor_type)(
             args.instruction_path, lm_config=llm_config, tokenizer=tokenizer
@@ -174,6 +210,7 @@ def construct_agent(args: argparse.Namespace) -> Agent:
             action_set_tag=args.action_set_tag,
             lm_config=llm_config,
             prompt_constructor=prompt_constructor,
+            llm_dispatcher=llm_dispatcher,
         )
     else:
         raise NotImplementedError(
@@ -0,0 +1,186 @@
+"""Fit the accessibility tree observations in the prompt token budget"""
+import re
+from dataclasses import dataclass
+from typing import Any
+
+from llms.tokenizers import Tokenizer
+
+# the roles the agent can act on
+INTERACTIVE_ROLES = {
+    "button",
+    "checkbox",
+    "combobox",
+    "link",
+    "listbox",
+    "menuitem",
+    "option",
+    "radio",
+    "searchbox",
+    "slider",
+    "spinbutton",
+    "switch",
+    "tab",
+    "textbox",
+}
+
+STOPWORDS = {
+    "and",
+    "are",
+    "for",
+    "from",
+    "how",
+    "many",
+    "much",
+    "the",
+    "that",
+    "this",
+    "what",
+    "which",
+    "with",
+}
+
+# \t\t[1234] role 'name' properties
+NODE_LINE_PATTERN = re.compile(r"^(\t*)\[(\d+)\] (\S+)(.*)$")
+
+
+@dataclass
+class ObservationLine:
+    text: str
+    node_id: str | None
+    role: str
+    content: str
+    # the index of the closest line with a smaller indentation
+    parent: int | None
+
+
+def get_words(text: str) -> set[str]:
+    return {
+        word
+        for word in re.findall(r"[a-z0-9]+", text.lower())
+        if len(word) > 2 and word not in STOPWORDS
+    }
+
+
+class ObservationCompressor:
+    """Keep the most useful nodes of an accessibility tree within a token
+    budget, instead of the first ones
+
+    Each node is scored by whether the agent can act on it, the words it
+    shares with the intent and how close it is to the top of the page. The
+    nodes are added from the best to the worst score with the ancestors
+    they miss, as long as they fit. The kept lines are unchanged and in
+    their original order, so the indentation still shows the structure and
+    every kept `[id]` can be used in an action. The lines before the tree,
+    e.g., the tab titles, are always kept.
+    """
+
+    interactive_weight = 2.0
+    keyword_weight = 3.0
+    position_weight = 1.0
+    # the distance, in pixels, over which the position score halves
+    position_scale = 720.0
+
+    def __init__(self, tokenizer: Tokenizer) -> None:
+        self.tokenizer = tokenizer
+
+    @staticmethod
+    def parse_lines(obs: str) -> list[ObservationLine]:
+        lines: list[ObservationLine] = []
+        # (depth, index) of the lines that can still have children
+        ancestors: list[tuple[int, int]] = []
+        for text in obs.split("\n"):
+            match = NODE_LINE_PATTERN.match(text)
+            if match is None:
+                lines.append(ObservationLine(text, None, "", "", None))
+                continue
+            depth = len(match.group(1))
+            while ancestors and ancestors[-1][0] >= depth:
+                ancestors.pop()
+            parent = ancestors[-1][1] if ancestors else None
+            ancestors.append((depth, len(lines)))
+            lines.append(
+                ObservationLine(
+                    text,
+                    match.group(2),
+                    match.group(3),
+                    match.group(4),
+                    parent,
+                )
+            )
+        return lines
+
+    def score(
+        self,
+        line: ObservationLine,
+        intent_words: set[str],
+        obs_nodes_info: dict[str, Any],
+        top: float,
+    ) -> float:
+        score = 0.0
+        if line.role in INTERACTIVE_ROLES:
+            score += self.interactive_weight
+        score += self.keyword_weight * len(
+            get_words(line.content) & intent_words
+        )
+        if line.node_id is None:
+            return score
+        bound = obs_nodes_info.get(line.node_id, {}).get("union_bound")
+        if bound:
+            score += self.position_weight / (
+                1 + max(bound[1] - top, 0) / self.position_scale
+            )
+        return score
+
+    def compress(
+        self,
+        obs: str,
+        max_length: int,
+        intent: str,
+        obs_nodes_info: dict[str, Any],
+    ) -> str:
+        lines = self.parse_lines(obs)
+        node_idxs = [
+            idx for idx, line in enumerate(lines) if line.node_id is not None
+        ]
+        if not node_idxs:
+            return self.tokenizer.truncate(obs, max_length)
+
+        costs = [
+            self.tokenizer.count_line_tokens(f"{line.text}\n")
+            for line in lines
+        ]
+        if sum(costs) <= max_length:
+            return obs
+
+        # the lines before the tree
+        selected = set(range(node_idxs[0]))
+        budget = max_length - sum(costs[idx] for idx in selected)
+        if budget <= 0:
+            return self.tokenizer.truncate(obs, max_length)
+
+        intent_words = get_words(intent)
+        tops = [
+            obs_nodes_info[line.node_id]["union_bound"][1]
+            for line in lines
+            if line.node_id in obs_nodes_info
+            and obs_nodes_info[line.node_id].get("union_bound")
+        ]
+        top = min(tops, default=0.0)
+        scores = {
+            idx: self.score(lines[idx], intent_words, obs_nodes_info, top)
+            for idx in node_idxs
+        }
+
+        # the ties keep the order of the page
+        for idx in sorted(node_idxs, key=lambda idx: (-scores[idx], idx)):
+            missing: list[int] = []
+            cursor: int | None = idx
+            while cursor is not None and cursor not in selected:
+                missing.append(cursor)
+                cursor = lines[cursor].parent
+            cost = sum(costs[i] for i in missing)
+            if cost <= budget:
+                selected.update(missing)
+                budget -= cost
+
+        return "\n".join(lines[idx].text for idx in sorted(selected))
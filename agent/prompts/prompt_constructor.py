@@ -3,6 +3,7 @@ import re
 from pathlib import Path
 from typing import Any, TypedDict
 
+from agent.prompts.compressor import ObservationCompressor
 from browser_env import Action, ActionParsingError, Trajectory
 from browser_env.env_config import URL_MAPPINGS
 from browser_env.utils import StateInfo
@@ -20,6 +21,35 @@ class Instruction(TypedDict):
     meta_data: dict[str, Any]
 
 
+# the static prefixes of the API inputs, shared by the constructors of the
+# same instruction
+STATIC_PREFIXES: dict[
+    tuple[str, str | None, str, str, tuple[tuple[str, str], ...]],
+    list[dict[str, str]] | str,
+] = {}
+
+
+# the instructions loaded by this process
+INSTRUCTIONS: dict[Path, Instruction] = {}
+
+# the rule of the intros that action chunks replace
+ONE_ACTION_RULE = re.compile(
+    r"You (should|can) only issue one action at a time"
+)
+
+
+def load_instruction(instruction_path: str | Path) -> Instruction:
+    """Load the instruction file once per process, the instruction is shared
+    and must not be modified"""
+    path = Path(instruction_path).resolve()
+    if path not in INSTRUCTIONS:
+        with open(path) as f:
+            instruction = json.load(f)
+        instruction["examples"] = [tuple(e) for e in instruction["examples"]]
+        INSTRUCTIONS[path] = instruction
+    return INSTRUCTIONS[path]
+
+
 class PromptConstructor(object):
     def __init__(
         self,
@@ -30,16 +60,58 @@ class PromptConstructor(object):
         self.instruction_path = Path(instruction_path)
         self.obs_modality = "text"
         self.lm_config = lm_config
-        instruction = json.load(open(self.instruction_path))
-        instruction["examples"] = [tuple(e) for e in instruction["examples"]]
-        self.instruction: Instruction = instruction
+        self.instruction: Instruction = load_instruction(self.instruction_path)
         self.tokenizer = tokenizer
+        self.compressor = ObservationCompressor(tokenizer)
 
     def get_lm_api_input(
         self, intro: str, examples: list[tuple[str, str]], current: str
     ) -> APIInput:
 
         """Return the require format for an API"""
+        prefix = self.get_static_prefix(intro, examples)
+        if "openai" in self.lm_config.provider:
+            if self.lm_config.mode == "chat":
+                assert isinstance(prefix, list)
+                return [*prefix, {"role": "user", "content": current}]
+            elif self.lm_config.mode == "completion":
+                assert isinstance(prefix, str)
+                message = prefix
+                message += f"Observation\n:{current}\n\n"
+                message += "Action:"
+                return message
+        elif "huggingface" in self.lm_config.provider:
+            assert isinstance(prefix, str)
+            B_INST, E_INST = "[INST]", "[/INST]"
+            BOS = "<s>"
+            # add the current observation
+            message = prefix
+            message += f"{BOS}{B_INST} {current.strip()} {E_INST} {self.instruction['meta_data'].get('force_prefix', '')}"
+            return message
+        raise NotImplementedError(
+            f"Provider {self.lm_config.provider} not implemented"
+        )
+
+    def get_static_prefix(
+        self, intro: str, examples: list[tuple[str, str]]
+    ) -> list[dict[str, str]] | str:
+        """The part of the API input before the current observation, the
+        same at every step, so it is built once per instruction. Keeping it
+        first lets the provider (or TGI) reuse its prompt cache"""
+        key = (
+            self.lm_config.provider,
+            self.lm_config.mode,
+            self.lm_config.model,
+            intro,
+            tuple(examples),
+        )
+        if key not in STATIC_PREFIXES:
+            STATIC_PREFIXES[key] = self.build_static_prefix(intro, examples)
+        return STATIC_PREFIXES[key]
+
+    def build_static_prefix(
+        self, intro: str, examples: list[tuple[str, str]]
+    ) -> list[dict[str, str]] | str:
         message: list[dict[str, str]] | str
         if "openai" in self.lm_config.provider:
             if self.lm_config.mode == "chat":
@@ -59,7 +131,6 @@ class PromptConstructor(object):
                             "content": y,
                         }
                     )
-                message.append({"role": "user", "content": current})
                 return message
             elif self.lm_config.mode == "completion":
                 message = f"{intro}\n\n"
@@ -68,8 +139,6 @@ class PromptConstructor(object):
                     message += f"Observation\n:{example[0]}\n\n"
                     message += f"Action: {example[1]}\n\n"
                 message += "Now make prediction given the observation\n\n"
-                message += f"Observation\n:{current}\n\n"
-                message += "Action:"
                 return message
             else:
                 raise ValueError(
@@ -96,9 +165,6 @@ class PromptConstructor(object):
                             for (x, y) in examples
                         ]
                     )
-                    # add the current observation
-                    message += f"{BOS}{B_INST} {current.strip()} {E_INST} {self.instruction['meta_data'].get('force_prefix', '')}"
-
                     return message
                 else:
                     raise ValueError("Only chat mode is supported for Llama-2")
@@ -119,6 +185,23 @@ class PromptConstructor(object):
     ) -> APIInput:
         raise NotImplementedError
 
+    def fit_observation(
+        self, obs: str, intent: str, state_info: StateInfo
+    ) -> str:
+        """Fit the observation in `max_obs_length` tokens, either by cutting
+        it or by keeping its most useful nodes"""
+        max_obs_length = self.lm_config.gen_config["max_obs_length"]
+        if not max_obs_length:
+            return obs
+        if self.lm_config.gen_config.get("obs_compression") == "structure":
+            obs_nodes_info = state_info["info"]["observation_metadata"][
+                self.obs_modality
+            ]["obs_nodes_info"]
+            return self.compressor.compress(
+                obs, max_obs_length, intent, obs_nodes_info
+            )
+        return self.tokenizer.truncate(obs, max_obs_length)
+
     def map_url_to_real(self, url: str) -> str:
         """Map the urls to their real world counterparts"""
         for i, j in URL_MAPPINGS.items():
@@ -144,6 +227,43 @@ class PromptConstructor(object):
         response = self.map_url_to_local(response)
         return response
 
+    def extract_actions(
+        self, response: str, max_actions: int = 1
+    ) -> list[str]:
+        """The actions in the response, up to `max_actions` in action chunk
+        mode, each wrapped in its own pair of action splitters"""
+        first_action = self.extract_action(response)
+        if max_actions == 1:
+            return [first_action]
+        action_splitter = self.instruction["meta_data"]["action_splitter"]
+        pattern = rf"{action_splitter}((.|\n)*?){action_splitter}"
+        actions = [
+            self.map_url_to_local(match.group(1).strip())
+            for match in re.finditer(pattern, response)
+        ]
+        return actions[:max_actions]
+
+    def get_intro(self) -> str:
+        intro = self.instruction["intro"]
+        action_chunk_size = self.lm_config.gen_config.get(
+            "action_chunk_size", 1
+        )
+        if action_chunk_size > 1:
+            action_splitter = self.instruction["meta_data"]["action_splitter"]
+            chunk_rule = (
+                f"You can issue up to {action_chunk_size} actions at a time,"
+                f" each wrapped in its own pair of {action_splitter}, e.g., to"
+                " fill several fields of a form. They are executed in order,"
+                " the actions after one that fails or changes the page are"
+                " dropped"
+            )
+            intro, n_rules = ONE_ACTION_RULE.subn(
+                lambda _: chunk_rule, intro, count=1
+            )
+            if n_rules == 0:
+                intro += f"\n\n{chunk_rule}."
+        return intro
+
 
 class DirectPromptConstructor(PromptConstructor):
     """The agent will direct predict the action"""
@@ -163,16 +283,14 @@ class DirectPromptConstructor(PromptConstructor):
         meta_data: dict[str, Any] = {},
     ) -> APIInput:
         """Construct prompt given the trajectory"""
-        intro = self.instruction["intro"]
+        intro = self.get_intro()
         examples = self.instruction["examples"]
         template = self.instruction["template"]
         keywords = self.instruction["meta_data"]["keywords"]
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
         obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.fit_observation(obs, intent, state_info)  # type: ignore[arg-type]
 
         page = state_info["info"]["page"]
         url = page.url
@@ -221,16 +339,14 @@ class CoTPromptConstructor(PromptConstructor):
         intent: str,
         meta_data: dict[str, Any] = {},
     ) -> APIInput:
-        intro = self.instruction["intro"]
+        intro = self.get_intro()
         examples = self.instruction["examples"]
         template = self.instruction["template"]
         keywords = self.instruction["meta_data"]["keywords"]
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
         obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.fit_observation(obs, intent, state_info)  # type: ignore[arg-type]
 
         page = state_info["info"]["page"]
         url = page.url
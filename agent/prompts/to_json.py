@@ -1,25 +1,55 @@
 import glob
+import hashlib
 import importlib
 import json
 import os
+import tempfile
+
+# the hashes of the python files the json files were converted from
+HASHES_FILE = "agent/prompts/jsons/.source_hashes.json"
+
+
+def write_atomic(path: str, content: str) -> None:
+    """Write the file with a rename, so that the concurrent runs never read
+    a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
 
 
 # use the current directory as the root
 def run() -> None:
     """Convert all python files in agent/prompts to json files in agent/prompts/jsons
 
-    Python files are easiser to edit
+    Python files are easiser to edit. Only the files that changed since
+    their last conversion are imported and converted again
     """
+    os.makedirs("agent/prompts/jsons", exist_ok=True)
+    hashes: dict[str, str] = {}
+    if os.path.exists(HASHES_FILE):
+        with open(HASHES_FILE, "r") as f:
+            hashes = json.load(f)
+
+    converted = 0
     for p_file in glob.glob(f"agent/prompts/raw/*.py"):
-        # import the file as a module
         base_name = os.path.basename(p_file).replace(".py", "")
+        json_file = f"agent/prompts/jsons/{base_name}.json"
+        with open(p_file, "rb") as f:
+            source_hash = hashlib.sha256(f.read()).hexdigest()
+        if hashes.get(base_name) == source_hash and os.path.exists(json_file):
+            continue
+        # import the file as a module
         module = importlib.import_module(f"agent.prompts.raw.{base_name}")
         prompt = module.prompt
         # save the prompt as a json file
-        os.makedirs("agent/prompts/jsons", exist_ok=True)
-        with open(f"agent/prompts/jsons/{base_name}.json", "w+") as f:
-            json.dump(prompt, f, indent=2)
-    print(f"Done convert python files to json")
+        write_atomic(json_file, json.dumps(prompt, indent=2))
+        hashes[base_name] = source_hash
+        converted += 1
+
+    if converted:
+        write_atomic(HASHES_FILE, json.dumps(hashes, indent=2))
+    print(f"Done convert python files to json ({converted} updated)")
 
 
 if __name__ == "__main__":
@@ -36,10 +36,12 @@ from .envs import ScriptBrowserEnv
 from .processors import ObservationMetadata
 from .trajectory import Trajectory
 from .utils import DetachedPage, StateInfo
+from .vector_envs import BrowserVectorEnv
 
 __all__ = [
     "ScriptBrowserEnv",
     "AsyncScriptBrowserEnv",
+    "BrowserVectorEnv",
     "DetachedPage",
     "StateInfo",
     "ObservationMetadata",
@@ -53,6 +53,40 @@ from browser_env.processors import (
     TextObervationProcessor,
 )
 
+# (x, y, width, height) of every element matched by a locator
+BOUNDING_RECTS_JS = """
+    elements => elements.map(element => {
+        const rect = element.getBoundingClientRect();
+        return [rect.x, rect.y, rect.width, rect.height];
+    })
+"""
+
+
+def get_in_viewport_mask(
+    boxes: npt.NDArray[np.float64],
+    viewport: ViewportSize,
+    threshold: float = 0.3,
+) -> npt.NDArray[np.bool_[Any]]:
+    """Vectorized in-viewport check of (N, 4) boxes of (x, y, width, height)
+
+    Empty boxes and NaN boxes (elements without a box) are not in the viewport.
+    """
+    boxx0 = boxes[:, 0]
+    boxx1 = boxes[:, 0] + boxes[:, 2]
+    boxy0 = boxes[:, 1]
+    boxy1 = boxes[:, 1] + boxes[:, 3]
+    viewportx0, viewporty0 = 0, 0
+    viewportx1, viewporty1 = viewport["width"], viewport["height"]
+    inter = np.maximum(
+        0, np.minimum(boxx1, viewportx1) - np.maximum(boxx0, viewportx0)
+    ) * np.maximum(
+        0, np.minimum(boxy1, viewporty1) - np.maximum(boxy0, viewporty0)
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = inter / (boxes[:, 2] * boxes[:, 3])
+    in_viewport: npt.NDArray[np.bool_[Any]] = ratio > threshold
+    return in_viewport
+
 
 def is_in_viewport(
     element: Locator, viewport: ViewportSize, threshold: float = 0.3
@@ -60,17 +94,10 @@ def is_in_viewport(
     """Given a playwright locator, check if it is in the viewport"""
     box = element.bounding_box()
     assert box is not None
-    boxx0 = box["x"]
-    boxx1 = box["x"] + box["width"]
-    boxy0 = box["y"]
-    boxy1 = box["y"] + box["height"]
-    viewportx0, viewporty0 = 0, 0
-    viewportx1, viewporty1 = viewport["width"], viewport["height"]
-    inter = max(0, min(boxx1, viewportx1) - max(boxx0, viewportx0)) * max(
-        0, min(boxy1, viewporty1) - max(boxy0, viewporty0)
+    boxes = np.array(
+        [[box["x"], box["y"], box["width"], box["height"]]], dtype=np.float64
     )
-    ratio = inter / (box["width"] * box["height"])
-    return ratio > threshold
+    return bool(get_in_viewport_mask(boxes, viewport, threshold)[0])
 
 
 async def async_is_in_viewport(
@@ -78,17 +105,47 @@ async def async_is_in_viewport(
 ) -> bool:
     box = await element.bounding_box()
     assert box is not None
-    boxx0 = box["x"]
-    boxx1 = box["x"] + box["width"]
-    boxy0 = box["y"]
-    boxy1 = box["y"] + box["height"]
-    viewportx0, viewporty0 = 0, 0
-    viewportx1, viewporty1 = viewport["width"], viewport["height"]
-    inter = max(0, min(boxx1, viewportx1) - max(boxx0, viewportx0)) * max(
-        0, min(boxy1, viewporty1) - max(boxy0, viewporty0)
+    boxes = np.array(
+        [[box["x"], box["y"], box["width"], box["height"]]], dtype=np.float64
     )
-    ratio = inter / (box["width"] * box["height"])
-    return ratio > threshold
+    return bool(get_in_viewport_mask(boxes, viewport, threshold)[0])
+
+
+def get_bounding_boxes(
+    locators: Locator, in_main_frame: bool
+) -> npt.NDArray[np.float64]:
+    """Return the (N, 4) boxes of all the elements matched by the locators
+
+    The boxes of the main frame are fetched in a single call, the boxes in
+    other frames need to be offset to the main frame by playwright.
+    """
+    if in_main_frame:
+        rects = locators.evaluate_all(BOUNDING_RECTS_JS)
+    else:
+        rects = []
+        for locator_idx in range(locators.count()):
+            box = locators.nth(locator_idx).bounding_box()
+            if box is None:
+                rects.append([np.nan] * 4)
+            else:
+                rects.append([box["x"], box["y"], box["width"], box["height"]])
+    return np.array(rects, dtype=np.float64).reshape(-1, 4)
+
+
+async def aget_bounding_boxes(
+    locators: ALocator, in_main_frame: bool
+) -> npt.NDArray[np.float64]:
+    if in_main_frame:
+        rects = await locators.evaluate_all(BOUNDING_RECTS_JS)
+    else:
+        rects = []
+        for locator_idx in range(await locators.count()):
+            box = await locators.nth(locator_idx).bounding_box()
+            if box is None:
+                rects.append([np.nan] * 4)
+            else:
+                rects.append([box["x"], box["y"], box["width"], box["height"]])
+    return np.array(rects, dtype=np.float64).reshape(-1, 4)
 
 
 class Action(TypedDict):
@@ -915,14 +972,16 @@ def execute_focus(
                 locators = frame.get_by_role(
                     role=element_role_str, name=element_name
                 )
-        for locator_idx in range(locators.count()):
-            locator = locators.nth(locator_idx)
-            if is_in_viewport(locator, page.viewport_size):
-                bounding_box = locator.bounding_box()
-                assert bounding_box
-                element_location_list.append(
-                    (locator, bounding_box["x"], bounding_box["y"])
+        boxes = get_bounding_boxes(locators, frame == page.main_frame)
+        in_viewport = get_in_viewport_mask(boxes, page.viewport_size)
+        for locator_idx in np.flatnonzero(in_viewport):
+            element_location_list.append(
+                (
+                    locators.nth(int(locator_idx)),
+                    boxes[locator_idx, 0],
+                    boxes[locator_idx, 1],
                 )
+            )
     if len(element_location_list) <= nth:
         raise ValueError(
             f"There are only {len(element_location_list)} elements found in viewport, but {nth + 1} is requested"
@@ -951,14 +1010,16 @@ async def aexecute_focus(
                 locators = frame.get_by_role(
                     role=element_role_str, name=element_name
                 )
-        for locator_idx in range(await locators.count()):
-            locator = locators.nth(locator_idx)
-            if await async_is_in_viewport(locator, page.viewport_size):
-                bounding_box = await locator.bounding_box()
-                assert bounding_box
-                element_location_list.append(
-                    (locator, bounding_box["x"], bounding_box["y"])
+        boxes = await aget_bounding_boxes(locators, frame == page.main_frame)
+        in_viewport = get_in_viewport_mask(boxes, page.viewport_size)
+        for locator_idx in np.flatnonzero(in_viewport):
+            element_location_list.append(
+                (
+                    locators.nth(int(locator_idx)),
+                    boxes[locator_idx, 0],
+                    boxes[locator_idx, 1],
                 )
+            )
     if len(element_location_list) <= nth:
         raise ValueError(
             f"There are only {len(element_location_list)} elements found in viewport, but {nth + 1} is requested"
@@ -1230,7 +1291,10 @@ def execute_action(
 
 
 async def aexecute_action(
-    action: Action, page: APage, browser_ctx: ABrowserContext
+    action: Action,
+    page: APage,
+    browser_ctx: ABrowserContext,
+    observation_processor: ObservationProcessor,
 ) -> APage:
     """Execute the async action on the ChromeDriver."""
     action_type = action["action_type"]
@@ -1259,7 +1323,11 @@ async def aexecute_action(
             # check each kind of locator in order
             # TODO[shuyanzh]: order is temp now
             if action["element_id"]:
-                raise NotImplementedError
+                element_id = action["element_id"]
+                element_center = observation_processor.get_element_center(element_id)  # type: ignore[attr-defined]
+                await aexecute_mouse_click(
+                    element_center[0], element_center[1], page
+                )
             elif action["element_role"] and action["element_name"]:
                 element_role = int(action["element_role"])
                 element_name = action["element_name"]
@@ -1277,7 +1345,11 @@ async def aexecute_action(
                 raise ValueError("No proper locator found for click action")
         case ActionTypes.HOVER:
             if action["element_id"]:
-                raise NotImplementedError
+                element_id = action["element_id"]
+                element_center = observation_processor.get_element_center(element_id)  # type: ignore[attr-defined]
+                await aexecute_mouse_hover(
+                    element_center[0], element_center[1], page
+                )
             elif action["element_role"] and action["element_name"]:
                 element_role = int(action["element_role"])
                 element_name = action["element_name"]
@@ -1296,7 +1368,12 @@ async def aexecute_action(
                 )
         case ActionTypes.TYPE:
             if action["element_id"]:
-                raise NotImplementedError
+                element_id = action["element_id"]
+                element_center = observation_processor.get_element_center(element_id)  # type: ignore[attr-defined]
+                await aexecute_mouse_click(
+                    element_center[0], element_center[1], page
+                )
+                await aexecute_type(action["text"], page)
             elif action["element_role"] and action["element_name"]:
                 element_role = int(action["element_role"])
                 element_name = action["element_name"]
@@ -1321,6 +1398,7 @@ async def aexecute_action(
             await page.bring_to_front()
         case ActionTypes.NEW_TAB:
             page = await browser_ctx.new_page()
+            page.client = await page.context.new_cdp_session(page)  # type: ignore[attr-defined]
         case ActionTypes.GO_BACK:
             await page.go_back()
         case ActionTypes.GO_FORWARD:
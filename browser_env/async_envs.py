@@ -1,25 +1,36 @@
 import asyncio
 import json
-from dataclasses import dataclass
 from pathlib import Path
+from typing import Any, Coroutine, TypeVar
 
-import numpy as np
-import numpy.typing as npt
 from gymnasium import Env
-from gymnasium.spaces import Box, Text
-from playwright.async_api import Page, ViewportSize, async_playwright
+from playwright.async_api import (
+    Browser,
+    CDPSession,
+    Page,
+    ViewportSize,
+    async_playwright,
+)
 
 from .actions import Action, aexecute_action, get_action_space
-from .utils import DetachedPage, png_bytes_to_numpy
+from .processors import ObservationHandler, ObservationMetadata
+from .utils import DetachedPage, Observation
 
+T = TypeVar("T")
 
-class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
+
+class AsyncScriptBrowserEnv(Env[dict[str, Observation], Action]):
     """
-    The goal of this environment is to produce a prototype of a browser environment.
-    In the end, we want to support a fully configurable browser environment with wide
-    range of action spaces and observation spaces, both structured and unstructured.
-    But in this prototype, we just support action space specified by Playwright script,
-    and observation space is the html content of the page.
+    The async counterpart of `ScriptBrowserEnv`, with the same observations,
+    actions and info. The coroutines `areset`, `astep` and `aclose` let one
+    event loop drive many environments concurrently. The sync `reset`,
+    `step` and `close` run them on a persistent event loop owned by the
+    environment, the playwright objects are bound to the loop they were
+    created in, so the two APIs must not be mixed on the same instance.
+
+    The observation is a screenshot by default, as before, but it is now
+    returned as `{"image": screenshot}` like the observations of
+    `ScriptBrowserEnv`.
     """
 
     def __init__(
@@ -28,28 +39,78 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         headless: bool = True,
         slow_mo: int = 0,
         timeout: int = 30000,
+        observation_type: str = "image",
+        current_viewport_only: bool = False,
         viewport_size: ViewportSize = {"width": 1280, "height": 720},
+        sleep_after_execution: float = 0.0,
+        browser: Browser | None = None,
+        incremental_observation: bool = False,
     ):
-        self.observation_space = Box(
-            0,
-            255,
-            (viewport_size["height"], viewport_size["width"], 4),
-            np.uint8,
-        )
         # TODO: make Space[Action] = ActionSpace
         self.action_space = get_action_space()  # type: ignore[assignment]
         self.headless = headless
         self.slow_mo = slow_mo
+        self.current_viewport_only = current_viewport_only
         self.reset_finished = False
         self.timeout = timeout
         self.viewport_size = viewport_size
+        self.sleep_after_execution = sleep_after_execution
+        self.loop: asyncio.AbstractEventLoop | None = None
+        # a browser shared with other environments, only the browser
+        # context is owned by this environment
+        self.shared_browser = browser
 
-    async def setup(self, config_file: Path | None = None) -> None:
-        self.context_manager = async_playwright()
-        self.playwright = await self.context_manager.__aenter__()
-        self.browser = await self.playwright.chromium.launch(
-            headless=self.headless, slow_mo=self.slow_mo
+        match observation_type:
+            case "html" | "accessibility_tree":
+                self.text_observation_type = observation_type
+                self.image_observation_type = ""
+                self.main_observation_type = "text"
+            case "image":
+                self.image_observation_type = observation_type
+                self.text_observation_type = ""  # type: ignore[assignment]
+                self.main_observation_type = "image"
+            case _:
+                raise ValueError(
+                    f"Unsupported observation type: {observation_type}"
+                )
+
+        self.observation_handler = ObservationHandler(
+            self.main_observation_type,
+            self.text_observation_type,
+            self.image_observation_type,
+            self.current_viewport_only,
+            self.viewport_size,
+            incremental_observation=incremental_observation,
+        )
+
+        self.observation_space = (
+            self.observation_handler.get_observation_space()
         )
+
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """Run a coroutine on the event loop of the sync api"""
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        return self.loop.run_until_complete(coroutine)
+
+    async def new_page(self) -> Page:
+        page = await self.context.new_page()
+        # talk to chrome devtools
+        client = await page.context.new_cdp_session(page)
+        if self.text_observation_type == "accessibility_tree":
+            await client.send("Accessibility.enable")
+        page.client = client  # type: ignore
+        return page
+
+    async def setup(self, config_file: Path | None = None) -> None:
+        if self.shared_browser is not None:
+            self.browser = self.shared_browser
+        else:
+            self.context_manager = async_playwright()
+            self.playwright = await self.context_manager.__aenter__()
+            self.browser = await self.playwright.chromium.launch(
+                headless=self.headless, slow_mo=self.slow_mo
+            )
         if config_file:
             with open(config_file, "r") as f:
                 instance_config = json.load(f)
@@ -66,24 +127,46 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
             geolocation=geolocation,
             device_scale_factor=1,
         )
-        self.page = await self.context.new_page()
+        self.context.set_default_timeout(self.timeout)
         if start_url:
-            await self.page.goto(start_url)
+            start_urls = start_url.split(" |AND| ")
+            for url in start_urls:
+                page = await self.new_page()
+                await page.goto(url)
+            # set the first page as the current page
+            self.page = self.context.pages[0]
+            await self.page.bring_to_front()
+        else:
+            self.page = await self.new_page()
+
+    def get_page_client(self, page: Page) -> CDPSession:
+        return page.client  # type: ignore
+
+    async def _aget_obs(self) -> dict[str, Observation]:
+        obs = await self.observation_handler.aget_observation(
+            self.page, self.get_page_client(self.page)
+        )
+        return obs
+
+    def _get_obs_metadata(self) -> dict[str, ObservationMetadata]:
+        metadata = self.observation_handler.get_observation_metadata()
+        return metadata
 
     async def areset(
         self,
         *,
         seed: int | None = None,
         options: dict[str, str] | None = None,
-    ) -> tuple[npt.NDArray[np.uint8], dict[str, object]]:
+    ) -> tuple[dict[str, Observation], dict[str, Any]]:
         """
         Reset the environment.
         :param options: options for the environment. The options are:
-            - storage_state: the path to the storage state file
+            - config_file: the path to the config file of the task
         """
         super().reset(seed=seed, options=options)
+        self.observation_handler.expire_observation()
         if self.reset_finished:
-            await self.context_manager.__aexit__()
+            await self.ateardown()
         if options is not None and "config_file" in options:
             config_file = Path(options["config_file"])
             if config_file.exists():
@@ -93,61 +176,86 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         else:
             await self.setup()
         self.reset_finished = True
-        content = await self.page.content()
-        screenshot = png_bytes_to_numpy(await self.page.screenshot())
-        return (
-            screenshot,
-            {"page": DetachedPage(self.page.url, content)},
-        )
+
+        if self.sleep_after_execution > 0:
+            await asyncio.sleep(self.sleep_after_execution)
+
+        observation = await self._aget_obs()
+        observation_metadata = self._get_obs_metadata()
+        info = {
+            "page": DetachedPage(self.page.url, ""),
+            "fail_error": "",
+            "observation_metadata": observation_metadata,
+        }
+        return (observation, info)
 
     def reset(
         self,
         *,
         seed: int | None = None,
         options: dict[str, str] | None = None,
-    ) -> tuple[npt.NDArray[np.uint8], dict[str, object]]:
-        return asyncio.run(self.areset(seed=seed, options=options))
+    ) -> tuple[dict[str, Observation], dict[str, Any]]:
+        return self.run(self.areset(seed=seed, options=options))
+
+    async def ateardown(self) -> None:
+        if self.shared_browser is not None:
+            await self.context.close()
+        else:
+            await self.context_manager.__aexit__()
 
     async def aclose(self) -> None:
         if self.reset_finished:
-            await self.context_manager.__aexit__()
+            await self.ateardown()
+            self.reset_finished = False
 
     def close(self) -> None:
-        asyncio.run(self.aclose())
+        if self.loop is None:
+            return
+        self.run(self.aclose())
+        self.loop.close()
+        self.loop = None
 
     async def astep(
         self, action: Action
-    ) -> tuple[npt.NDArray[np.uint8], float, bool, bool, dict[str, object]]:
+    ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
         if not self.reset_finished:
             raise RuntimeError("Call reset first before calling step.")
+
+        self.observation_handler.expire_observation()
+
         success = False
         fail_error = ""
         try:
-            self.page = await aexecute_action(action, self.page, self.context)
+            self.page = await aexecute_action(
+                action,
+                self.page,
+                self.context,
+                self.observation_handler.action_processor,
+            )
             success = True
         except Exception as e:
             fail_error = str(e)
 
-        try:
-            content = await self.page.content()
-            screenshot = png_bytes_to_numpy(await self.page.screenshot())
-        except:
-            await self.page.wait_for_load_state("load")
-            content = await self.page.content()
-            screenshot = png_bytes_to_numpy(await self.page.screenshot())
+        if self.sleep_after_execution > 0:
+            await asyncio.sleep(self.sleep_after_execution)
+
+        observation = await self._aget_obs()
+        observation_metadata = self._get_obs_metadata()
 
+        info = {
+            "page": DetachedPage(self.page.url, await self.page.content()),
+            "fail_error": fail_error,
+            "observation_metadata": observation_metadata,
+        }
         return (
-            screenshot,
-            float(success),
-            False,
-            False,
-            {
-                "page": DetachedPage(self.page.url, content),
-                "fail_error": fail_error,
-            },
+            observation,
+            float(success),  # reward
+            False,  # terminated
+            False,  # truncated
+            info,
         )
 
     def step(
         self, action: Action
-    ) -> tuple[npt.NDArray[np.uint8], float, bool, bool, dict[str, object]]:
-        return asyncio.run(self.astep(action), debug=True)
+    ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
+        return self.run(self.astep(action))
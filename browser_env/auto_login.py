@@ -1,12 +1,18 @@
 """Script to automatically login each website"""
 import argparse
+import fcntl
 import glob
+import json
 import os
+import re
 import time
 from concurrent.futures import ThreadPoolExecutor
 from itertools import combinations
 from pathlib import Path
+from typing import Any, Callable, TypeVar
+from urllib.parse import urlparse
 
+import requests
 from playwright.sync_api import sync_playwright
 
 from browser_env.env_config import (
@@ -30,6 +36,79 @@ URLS = [
 ]
 EXACT_MATCH = [True, True, True, True]
 KEYWORDS = ["", "", "Dashboard", "Delete"]
+HTTP_TIMEOUT = 10
+
+T = TypeVar("T")
+
+
+def run_in_thread(func: Callable[..., T], *args: Any) -> T:
+    """Run `func` in a new thread
+
+    The sync playwright api cannot start in a thread that already runs it,
+    e.g., a worker whose browser env is still open, a new thread can.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(func, *args).result()
+
+
+def get_jar_domain(domain: str) -> str:
+    """The domain of a cookie in the cookie jar of requests
+
+    The jar appends .local to the host names without a dot, e.g., localhost
+    or a docker service name, and only sends their cookies when stored with
+    this domain, while the browser stores them with the plain host name.
+    """
+    host = domain.lstrip(".")
+    return domain if "." in host else f"{host}.local"
+
+
+def load_storage_state_session(storage_state: Path) -> requests.Session:
+    """Create a requests session with the cookies of a storage state"""
+    with open(storage_state, "r") as f:
+        state = json.load(f)
+    session = requests.Session()
+    for cookie in state.get("cookies", []):
+        # -1 is a session cookie in playwright
+        expires = cookie.get("expires", -1)
+        session.cookies.set(
+            cookie["name"],
+            cookie["value"],
+            domain=get_jar_domain(cookie["domain"]),
+            path=cookie.get("path", "/"),
+            secure=cookie.get("secure", False),
+            expires=int(expires) if expires > 0 else None,
+        )
+    return session
+
+
+def is_expired_http(
+    storage_state: Path, url: str, keyword: str, url_exact: bool = True
+) -> bool | None:
+    """Test whether the cookie is expired with a plain HTTP request
+
+    Return None when it cannot tell, e.g. the keyword is missing from a page
+    that may be rendered by javascript, or the site is unreachable.
+    """
+    try:
+        session = load_storage_state_session(storage_state)
+        response = session.get(url, allow_redirects=True, timeout=HTTP_TIMEOUT)
+    except Exception:
+        return None
+    if not response.ok:
+        return None
+    d_url = response.url
+    if keyword:
+        if keyword in response.text:
+            return False
+        # redirected to a login page
+        if d_url != url:
+            return True
+        return None
+    else:
+        if url_exact:
+            return d_url != url
+        else:
+            return url not in d_url
 
 
 def is_expired(
@@ -39,6 +118,19 @@ def is_expired(
     if not storage_state.exists():
         return True
 
+    # only launch a browser when the HTTP check is inconclusive
+    expired = is_expired_http(storage_state, url, keyword, url_exact)
+    if expired is not None:
+        return expired
+    return run_in_thread(
+        is_expired_browser, storage_state, url, keyword, url_exact
+    )
+
+
+def is_expired_browser(
+    storage_state: Path, url: str, keyword: str, url_exact: bool = True
+) -> bool:
+    """Test whether the cookie is expired by loading the page in a browser"""
     context_manager = sync_playwright()
     playwright = context_manager.__enter__()
     browser = playwright.chromium.launch(headless=True, slow_mo=SLOW_MO)
@@ -58,7 +150,172 @@ def is_expired(
             return url not in d_url
 
 
-def renew_comb(comb: list[str], auth_folder: str = "./.auth") -> None:
+def get_hidden_input(html: str, name: str) -> str | None:
+    """Get the value of a hidden input of a form, e.g. a CSRF token"""
+    for tag in re.findall(r"<input[^>]*>", html):
+        if re.search(rf'name="{re.escape(name)}"', tag):
+            value = re.search(r'value="([^"]*)"', tag)
+            if value:
+                return value.group(1)
+    return None
+
+
+def http_login(
+    session: requests.Session,
+    login_url: str,
+    post_url: str,
+    token_name: str,
+    data: dict[str, str],
+) -> None:
+    """Log in by posting the login form with its CSRF token"""
+    response = session.get(login_url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    token = get_hidden_input(response.text, token_name)
+    if token is None:
+        raise ValueError(f"No {token_name} in {login_url}")
+    response = session.post(
+        post_url,
+        data={token_name: token, **data},
+        allow_redirects=True,
+        timeout=HTTP_TIMEOUT,
+    )
+    response.raise_for_status()
+
+
+def session_to_storage_state(
+    session: requests.Session, urls: list[str]
+) -> dict[str, Any]:
+    """Convert the cookies of a session to a playwright storage state
+
+    The cookies the jar stored under <host>.local get back the host name of
+    the site in `urls`, which is the domain the browser sends them to.
+    """
+    hosts = {
+        get_jar_domain(host): host
+        for host in (urlparse(url).hostname for url in urls)
+        if host
+    }
+    cookies = []
+    for cookie in session.cookies:
+        cookies.append(
+            {
+                "name": cookie.name,
+                "value": cookie.value,
+                "domain": hosts.get(cookie.domain, cookie.domain),
+                "path": cookie.path,
+                "expires": cookie.expires if cookie.expires else -1,
+                "httpOnly": cookie.has_nonstandard_attr("HttpOnly")
+                or cookie.has_nonstandard_attr("httponly"),
+                "secure": cookie.secure,
+                "sameSite": "Lax",
+            }
+        )
+    return {"cookies": cookies, "origins": []}
+
+
+def has_browser_cookies(state: dict[str, Any], url: str) -> bool:
+    """Whether the browser sends any cookie of a storage state to `url`"""
+    host = urlparse(url).hostname or ""
+    for cookie in state["cookies"]:
+        domain = cookie["domain"].lstrip(".")
+        if host == domain or host.endswith(f".{domain}"):
+            return True
+    return False
+
+
+def renew_comb_http(comb: list[str], auth_folder: str = "./.auth") -> bool:
+    """Log in with HTTP requests instead of the login forms of a browser
+
+    Return whether the login worked for all the sites of the combination.
+    """
+    storage_state = Path(auth_folder) / f"{'.'.join(comb)}_state.json"
+    session = requests.Session()
+    try:
+        if "shopping" in comb:
+            http_login(
+                session,
+                f"{SHOPPING}/customer/account/login/",
+                f"{SHOPPING}/customer/account/loginPost/",
+                "form_key",
+                {
+                    "login[username]": ACCOUNTS["shopping"]["username"],
+                    "login[password]": ACCOUNTS["shopping"]["password"],
+                },
+            )
+
+        if "reddit" in comb:
+            http_login(
+                session,
+                f"{REDDIT}/login",
+                f"{REDDIT}/login_check",
+                "_csrf_token",
+                {
+                    "_username": ACCOUNTS["reddit"]["username"],
+                    "_password": ACCOUNTS["reddit"]["password"],
+                },
+            )
+
+        if "shopping_admin" in comb:
+            http_login(
+                session,
+                f"{SHOPPING_ADMIN}",
+                f"{SHOPPING_ADMIN}",
+                "form_key",
+                {
+                    "login[username]": ACCOUNTS["shopping_admin"]["username"],
+                    "login[password]": ACCOUNTS["shopping_admin"]["password"],
+                },
+            )
+
+        if "gitlab" in comb:
+            http_login(
+                session,
+                f"{GITLAB}/users/sign_in",
+                f"{GITLAB}/users/sign_in",
+                "authenticity_token",
+                {
+                    "user[login]": ACCOUNTS["gitlab"]["username"],
+                    "user[password]": ACCOUNTS["gitlab"]["password"],
+                    "user[remember_me]": "0",
+                },
+            )
+    except Exception:
+        return False
+
+    urls = [URLS[SITES.index(cur_site)] for cur_site in comb]
+    state = session_to_storage_state(session, urls)
+    tmp_storage_state = storage_state.with_suffix(".tmp")
+    with open(tmp_storage_state, "w") as f:
+        json.dump(state, f)
+
+    # keep the state only if every site accepts it, the browser must get
+    # the cookies as well since the HTTP check reads them with requests
+    for cur_site in comb:
+        url = URLS[SITES.index(cur_site)]
+        keyword = KEYWORDS[SITES.index(cur_site)]
+        match = EXACT_MATCH[SITES.index(cur_site)]
+        if not has_browser_cookies(state, url):
+            tmp_storage_state.unlink()
+            return False
+        expired = is_expired_http(tmp_storage_state, url, keyword, match)
+        if expired is not False:
+            tmp_storage_state.unlink()
+            return False
+    os.replace(tmp_storage_state, storage_state)
+    return True
+
+
+def renew_comb(
+    comb: list[str], auth_folder: str = "./.auth", use_http: bool = True
+) -> None:
+    # the browser is only used when the HTTP login fails
+    if use_http and renew_comb_http(comb, auth_folder=auth_folder):
+        return
+    run_in_thread(renew_comb_browser, comb, auth_folder)
+
+
+def renew_comb_browser(comb: list[str], auth_folder: str = "./.auth") -> None:
+    """Log in with the login forms of a browser"""
     context_manager = sync_playwright()
     playwright = context_manager.__enter__()
     browser = playwright.chromium.launch(headless=HEADLESS)
@@ -109,6 +366,48 @@ def get_site_comb_from_filepath(file_path: str) -> list[str]:
     return comb
 
 
+def is_comb_expired(storage_state: Path, comb: list[str]) -> bool:
+    with ThreadPoolExecutor(max_workers=len(comb)) as executor:
+        futures = []
+        for cur_site in comb:
+            url = URLS[SITES.index(cur_site)]
+            keyword = KEYWORDS[SITES.index(cur_site)]
+            match = EXACT_MATCH[SITES.index(cur_site)]
+            futures.append(
+                executor.submit(is_expired, storage_state, url, keyword, match)
+            )
+    return any(future.result() for future in futures)
+
+
+def get_storage_state(
+    comb: list[str], cache_folder: str = "./.auth_cache", ttl: float = 3600
+) -> str:
+    """Get a valid storage state file for a site combination
+
+    The storage states are cached in `cache_folder`. A cached state younger
+    than `ttl` seconds is used as is; an older one is checked first, and is
+    renewed only if it expired. The cache is locked per combination, so the
+    processes sharing the folder log in once and reuse the same state.
+    """
+    Path(cache_folder).mkdir(parents=True, exist_ok=True)
+    storage_state = Path(cache_folder) / f"{'.'.join(comb)}_state.json"
+    with open(f"{storage_state}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if storage_state.exists():
+                age = time.time() - storage_state.stat().st_mtime
+                if age < ttl:
+                    return str(storage_state)
+                if not is_comb_expired(storage_state, comb):
+                    # still valid, trust it for another ttl
+                    storage_state.touch()
+                    return str(storage_state)
+            renew_comb(comb, auth_folder=cache_folder)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return str(storage_state)
+
+
 def main(auth_folder: str = "./.auth") -> None:
     pairs = list(combinations(SITES, 2))
 
@@ -23,6 +23,7 @@ from playwright.sync_api import (
 
 from .actions import Action, execute_action, get_action_space
 from .processors import ObservationHandler, ObservationMetadata
+from .settle import PageSettleDetector
 from .utils import (
     AccessibilityTree,
     DetachedPage,
@@ -84,6 +85,9 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         viewport_size: ViewportSize = {"width": 1280, "height": 720},
         save_trace_enabled: bool = False,
         sleep_after_execution: float = 0.0,
+        reuse_browser: bool = False,
+        settle_strategy: str = "sleep",
+        incremental_observation: bool = False,
     ):
         # TODO: make Space[Action] = ActionSpace
         self.action_space = get_action_space()  # type: ignore[assignment]
@@ -94,6 +98,19 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         self.viewport_size = viewport_size
         self.save_trace_enabled = save_trace_enabled
         self.sleep_after_execution = sleep_after_execution
+        # keep the playwright driver and the browser alive across resets,
+        # only a new browser context is created for each task
+        self.reuse_browser = reuse_browser
+
+        # how to wait for the page after each action
+        # sleep: always sleep for sleep_after_execution seconds
+        # adaptive: wait for network and DOM quiescence, capped by sleep_after_execution
+        if settle_strategy not in ["sleep", "adaptive"]:
+            raise ValueError(f"Unsupported settle strategy: {settle_strategy}")
+        self.settle_strategy = settle_strategy
+        self.settle_detector = PageSettleDetector(
+            timeout=sleep_after_execution
+        )
 
         match observation_type:
             case "html" | "accessibility_tree":
@@ -115,20 +132,43 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             self.image_observation_type,
             self.current_viewport_only,
             self.viewport_size,
+            incremental_observation=incremental_observation,
         )
 
         self.observation_space = (
             self.observation_handler.get_observation_space()
         )
 
-    @beartype
-    def setup(self, config_file: Path | None = None) -> None:
+    def launch_browser(self) -> None:
         self.context_manager = sync_playwright()
         self.playwright = self.context_manager.__enter__()
         self.browser = self.playwright.chromium.launch(
             headless=self.headless, slow_mo=self.slow_mo
         )
 
+    def is_browser_alive(self) -> bool:
+        """Health check of the browser kept alive across resets"""
+        try:
+            return self.browser.is_connected()
+        except Exception:
+            return False
+
+    def close_browser(self) -> None:
+        try:
+            self.context_manager.__exit__()
+        except Exception:
+            # the driver may already be gone if the browser crashed
+            pass
+
+    @beartype
+    def setup(self, config_file: Path | None = None) -> None:
+        if not (self.reuse_browser and self.reset_finished):
+            self.launch_browser()
+        elif not self.is_browser_alive():
+            # relaunch the browser if it crashed
+            self.close_browser()
+            self.launch_browser()
+
         if config_file:
             with open(config_file, "r") as f:
                 instance_config = json.load(f)
@@ -145,6 +185,8 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             geolocation=geolocation,
             device_scale_factor=1,
         )
+        if self.settle_strategy == "adaptive":
+            self.settle_detector.attach(self.context)
         if self.save_trace_enabled:
             self.context.tracing.start(screenshots=True, snapshots=True)
         if start_url:
@@ -168,6 +210,15 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
                 client.send("Accessibility.enable")
             self.page.client = client  # type: ignore
 
+    def settle(self) -> float:
+        """Wait for the page after an action, return the time spent"""
+        if self.sleep_after_execution <= 0:
+            return 0.0
+        if self.settle_strategy == "adaptive":
+            return self.settle_detector.wait(self.page)
+        time.sleep(self.sleep_after_execution)
+        return self.sleep_after_execution
+
     def get_page_client(self, page: Page) -> CDPSession:
         return page.client  # type: ignore
 
@@ -194,8 +245,16 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             - "storage_state": the storage state of the browser. It is a file path to a json file.
         """
         super().reset(seed=seed, options=options)
+        self.observation_handler.expire_observation()
         if self.reset_finished:
-            self.context_manager.__exit__()
+            if self.reuse_browser:
+                try:
+                    self.context.close()
+                except Exception:
+                    # the browser crashed, it is relaunched in setup
+                    pass
+            else:
+                self.context_manager.__exit__()
 
         if options is not None and "config_file" in options:
             config_file = Path(options["config_file"])
@@ -207,8 +266,7 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             self.setup()
         self.reset_finished = True
 
-        if self.sleep_after_execution > 0:
-            time.sleep(self.sleep_after_execution)
+        settle_time = self.settle()
 
         observation = self._get_obs()
         observation_metadata = self._get_obs_metadata()
@@ -216,6 +274,7 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             "page": DetachedPage(self.page.url, ""),
             "fail_error": "",
             "observation_metadata": observation_metadata,
+            "settle_time": settle_time,
         }
 
         return (observation, info)
@@ -234,6 +293,9 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         if not self.reset_finished:
             raise RuntimeError("Call reset first before calling step.")
 
+        # the pending modalities of the previous observation are not valid anymore
+        self.observation_handler.expire_observation()
+
         success = False
         fail_error = ""
         try:
@@ -247,9 +309,7 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         except Exception as e:
             fail_error = str(e)
 
-        # hard sleep TODO[shuyanzh] suboptimal, may need to check network
-        if self.sleep_after_execution > 0:
-            time.sleep(self.sleep_after_execution)
+        settle_time = self.settle()
 
         observation = self._get_obs()
         observation_metadata = self._get_obs_metadata()
@@ -258,6 +318,7 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             "page": DetachedPage(self.page.url, self.page.content()),
             "fail_error": fail_error,
             "observation_metadata": observation_metadata,
+            "settle_time": settle_time,
         }
         msg = (
             observation,
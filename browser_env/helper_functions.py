@@ -2,8 +2,9 @@ import base64
 import io
 import json
 import re
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, TypeVar
 
 from PIL import Image
 
@@ -12,6 +13,7 @@ from browser_env import (
     Action,
     ActionTypes,
     ObservationMetadata,
+    ScriptBrowserEnv,
     StateInfo,
     action2str,
 )
@@ -33,6 +35,8 @@ HTML_TEMPLATE = """
 </html>
 """
 
+T = TypeVar("T")
+
 
 def get_render_action(
     action: Action,
@@ -110,6 +114,25 @@ def get_action_description(
     return action_str
 
 
+def breaks_action_chunk(
+    action: Action, prev_url: str, info: dict[str, Any]
+) -> bool:
+    """The rest of an action chunk was predicted for the page before the
+    action, it is dropped when the action fails or changes the page"""
+    if info["fail_error"]:
+        return True
+    if info["page"].url != prev_url:
+        return True
+    return action["action_type"] in [
+        ActionTypes.NEW_TAB,
+        ActionTypes.PAGE_FOCUS,
+        ActionTypes.PAGE_CLOSE,
+        ActionTypes.GO_BACK,
+        ActionTypes.GO_FORWARD,
+        ActionTypes.GOTO_URL,
+    ]
+
+
 class RenderHelper(object):
     """Helper class to render text and image observations and meta data in the trajectory"""
 
@@ -189,3 +212,90 @@ class RenderHelper(object):
 
     def close(self) -> None:
         self.render_file.close()
+
+
+class StepPipeline:
+    """Overlap the steps of a trajectory with the work around them
+
+    The sync playwright objects are bound to the thread that created them,
+    so the browser work stays in the calling thread and the rest moves to
+    background threads. While the agent waits for the LLM, the calling
+    thread takes the screenshot needed by the render and keeps servicing
+    the browser events, e.g., the accessibility tree updates of an
+    incremental observation. The render output is encoded and written
+    while the next action is executed, in the order of the steps.
+    """
+
+    # seconds between two checks of the pending prediction
+    poll_interval = 0.02
+
+    def __init__(
+        self,
+        env: ScriptBrowserEnv,
+        render_helper: RenderHelper,
+        render_screenshot: bool = False,
+    ) -> None:
+        self.env = env
+        self.render_helper = render_helper
+        self.render_screenshot = render_screenshot
+        self.predict_executor = ThreadPoolExecutor(max_workers=1)
+        self.render_executor = ThreadPoolExecutor(max_workers=1)
+        self.render_futures: list[Future[None]] = []
+
+    def prefetch(self, state_info: StateInfo) -> None:
+        """Compute the lazy modalities the render needs, while the page is
+        unchanged"""
+        if self.render_screenshot:
+            state_info["observation"]["image"]
+
+    def predict(
+        self, next_action: Callable[[], T], state_info: StateInfo
+    ) -> T:
+        future = self.predict_executor.submit(next_action)
+        self.prefetch(state_info)
+        while not future.done():
+            try:
+                self.env.page.wait_for_timeout(self.poll_interval * 1000)
+            except Exception:
+                # the page is gone, nothing to service
+                break
+        return future.result()
+
+    def render(
+        self,
+        action: Action,
+        state_info: StateInfo,
+        meta_data: dict[str, Any],
+    ) -> None:
+        self.prefetch(state_info)
+        # the metadata is updated in place by the next observation
+        info = {
+            **state_info["info"],
+            "observation_metadata": {
+                k: dict(v)
+                for k, v in state_info["info"]["observation_metadata"].items()
+            },
+        }
+        meta_data = {
+            **meta_data,
+            "action_history": list(meta_data["action_history"]),
+        }
+        self.render_futures.append(
+            self.render_executor.submit(
+                self.render_helper.render,
+                action,
+                {"observation": state_info["observation"], "info": info},
+                meta_data,
+                self.render_screenshot,
+            )
+        )
+
+    def flush(self) -> None:
+        """Wait for the pending renders, raise their errors"""
+        futures, self.render_futures = self.render_futures, []
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        self.predict_executor.shutdown()
+        self.render_executor.shutdown()
@@ -1,11 +1,14 @@
+import asyncio
 import json
 import re
 from collections import defaultdict
-from typing import Any, TypedDict, Union
+from typing import Any, Callable, TypedDict, Union
 
 import numpy as np
 import numpy.typing as npt
 from gymnasium import spaces
+from playwright.async_api import CDPSession as ACDPSession
+from playwright.async_api import Page as APage
 from playwright.sync_api import CDPSession, Page, ViewportSize
 
 from browser_env.constants import (
@@ -28,28 +31,148 @@ from .utils import (
 
 IN_VIEWPORT_RATIO_THRESHOLD = 0.6
 
+# the scroll offset, the screen size and the pixel ratio in one evaluation
+WINDOW_INFO_JS = """
+    () => ({
+        pageYOffset: window.pageYOffset,
+        pageXOffset: window.pageXOffset,
+        screenWidth: window.screen.width,
+        screenHeight: window.screen.height,
+        devicePixelRatio: window.devicePixelRatio,
+    })
+"""
+
+BOUNDING_CLIENT_RECT_JS = """
+    function() {
+        if (this.nodeType == 3) {
+            var range = document.createRange();
+            range.selectNode(this);
+            var rect = range.getBoundingClientRect().toJSON();
+            range.detach();
+            return rect;
+        } else {
+            return this.getBoundingClientRect().toJSON();
+        }
+    }
+"""
+
+DOM_SNAPSHOT_PARAMS = {
+    "computedStyles": [],
+    "includeDOMRects": True,
+    "includePaintOrder": True,
+}
+
 
 class ObservationProcessor:
     def process(self, page: Page, client: CDPSession) -> Observation:
         raise NotImplementedError
 
+    async def aprocess(self, page: APage, client: ACDPSession) -> Observation:
+        raise NotImplementedError
+
 
 class ObservationMetadata(TypedDict):
     obs_nodes_info: dict[str, Any]
+    # the changed nodes since the previous observation, in incremental mode
+    obs_diff: str
 
 
 def create_empty_metadata() -> ObservationMetadata:
     return {
         "obs_nodes_info": {},
+        "obs_diff": "",
     }
 
 
+def get_observation_diff(
+    prev_obs_nodes_info: dict[str, Any], obs_nodes_info: dict[str, Any]
+) -> str:
+    """A compact diff of two observations, keyed by the node ids
+
+    Added or changed nodes are prefixed with "+", removed nodes with "-".
+    """
+    diff_lines = []
+    for node_id, node_info in prev_obs_nodes_info.items():
+        if node_id not in obs_nodes_info:
+            diff_lines.append(f"- {node_info['text']}")
+    for node_id, node_info in obs_nodes_info.items():
+        prev_node_info = prev_obs_nodes_info.get(node_id)
+        if (
+            prev_node_info is None
+            or prev_node_info["text"] != node_info["text"]
+        ):
+            if prev_node_info is not None:
+                diff_lines.append(f"- {prev_node_info['text']}")
+            diff_lines.append(f"+ {node_info['text']}")
+    return "\n".join(diff_lines)
+
+
+def get_dom_fingerprint(info: BrowserInfo) -> int:
+    """A hash of the nodes, texts and attributes of the DOM snapshot, it
+    does not change when the page is only scrolled"""
+    tree = info["DOMTree"]
+    return hash(
+        (
+            tuple(tree["strings"]),
+            *(
+                (
+                    tuple(document["nodes"]["backendNodeId"]),
+                    tuple(document["nodes"]["nodeValue"]),
+                    tuple(map(tuple, document["nodes"]["attributes"])),
+                )
+                for document in tree["documents"]
+            ),
+        )
+    )
+
+
+def remove_nodes_from_tree(
+    tree: list[dict[str, Any]],
+    removed: list[bool],
+    nodeid_to_cursor: dict[str, int],
+) -> None:
+    """Splice the removed nodes out of the tree in a single pass
+
+    The children of a removed node take its place, in the same order, in the
+    child list of its closest kept ancestor, and their parent is updated
+    accordingly. The removed nodes are marked with the parent "[REMOVED]".
+    """
+    for cursor, node in enumerate(tree):
+        if removed[cursor]:
+            continue
+        child_ids = []
+        # walk down through the removed children to the kept descendants
+        stack = list(reversed(node["childIds"]))
+        while stack:
+            child_id = stack.pop()
+            if child_id not in nodeid_to_cursor:
+                child_ids.append(child_id)
+                continue
+            child = tree[nodeid_to_cursor[child_id]]
+            if removed[nodeid_to_cursor[child_id]]:
+                stack.extend(reversed(child["childIds"]))
+            else:
+                child_ids.append(child_id)
+                child["parentId"] = node["nodeId"]
+        node["childIds"] = child_ids
+
+    for cursor, node in enumerate(tree):
+        if removed[cursor]:
+            node["parentId"] = "[REMOVED]"
+
+
 class TextObervationProcessor(ObservationProcessor):
+    # incremental mode: the whole accessibility tree is fetched again at
+    # least every this many steps, which bounds how long an update the
+    # browser did not report can be missed
+    max_incremental_steps = 10
+
     def __init__(
         self,
         observation_type: str,
         current_viewport_only: bool,
         viewport_size: ViewportSize,
+        incremental: bool = False,
     ):
         self.observation_type = observation_type
         self.current_viewport_only = current_viewport_only
@@ -59,21 +182,42 @@ class TextObervationProcessor(ObservationProcessor):
             create_empty_metadata()
         )  # use the store meta data of this observation type
 
+        # incremental mode: keep the accessibility tree of the previous step
+        # and only fetch the nodes reported as updated by the browser, only
+        # the client of the cache is listened to
+        self.incremental = incremental
+        self.ax_node_cache: dict[str, AccessibilityTreeNode] | None = None
+        self.ax_cache_client: CDPSession | ACDPSession | None = None
+        self.ax_cache_steps = 0
+        self.updated_ax_nodes: list[AccessibilityTreeNode] = []
+        self.dom_fingerprint: int | None = None
+        self.dom_backend_ids: set[int] = set()
+        self.obs_nodes_info: dict[str, Any] = {}
+
     def fetch_browser_info(
         self,
         page: Page,
         client: CDPSession,
     ) -> BrowserInfo:
         # extract domtree
-        tree = client.send(
-            "DOMSnapshot.captureSnapshot",
-            {
-                "computedStyles": [],
-                "includeDOMRects": True,
-                "includePaintOrder": True,
-            },
+        tree = client.send("DOMSnapshot.captureSnapshot", DOM_SNAPSHOT_PARAMS)
+        window = page.evaluate(WINDOW_INFO_JS)
+        return self.make_browser_info(tree, window)
+
+    async def afetch_browser_info(
+        self,
+        page: APage,
+        client: ACDPSession,
+    ) -> BrowserInfo:
+        tree = await client.send(
+            "DOMSnapshot.captureSnapshot", DOM_SNAPSHOT_PARAMS
         )
+        window = await page.evaluate(WINDOW_INFO_JS)
+        return self.make_browser_info(tree, window)
 
+    def make_browser_info(
+        self, tree: dict[str, Any], window: dict[str, Any]
+    ) -> BrowserInfo:
         # calibrate the bounds, in some cases, the bounds are scaled somehow
         bounds = tree["documents"][0]["layout"]["bounds"]
         b = bounds[0]
@@ -82,13 +226,13 @@ class TextObervationProcessor(ObservationProcessor):
         tree["documents"][0]["layout"]["bounds"] = bounds
 
         # extract browser info
-        win_top_bound = page.evaluate("window.pageYOffset")
-        win_left_bound = page.evaluate("window.pageXOffset")
-        win_width = page.evaluate("window.screen.width")
-        win_height = page.evaluate("window.screen.height")
+        win_top_bound = window["pageYOffset"]
+        win_left_bound = window["pageXOffset"]
+        win_width = window["screenWidth"]
+        win_height = window["screenHeight"]
         win_right_bound = win_left_bound + win_width
         win_lower_bound = win_top_bound + win_height
-        device_pixel_ratio = page.evaluate("window.devicePixelRatio")
+        device_pixel_ratio = window["devicePixelRatio"]
         assert device_pixel_ratio == 1.0, "devicePixelRatio is not 1.0"
 
         config: BrowserConfig = {
@@ -119,19 +263,28 @@ class TextObervationProcessor(ObservationProcessor):
                 "Runtime.callFunctionOn",
                 {
                     "objectId": remote_object_id,
-                    "functionDeclaration": """
-                        function() {
-                            if (this.nodeType == 3) {
-                                var range = document.createRange();
-                                range.selectNode(this);
-                                var rect = range.getBoundingClientRect().toJSON();
-                                range.detach();
-                                return rect;
-                            } else {
-                                return this.getBoundingClientRect().toJSON();
-                            }
-                        }
-                    """,
+                    "functionDeclaration": BOUNDING_CLIENT_RECT_JS,
+                    "returnByValue": True,
+                },
+            )
+            return response
+        except Exception as e:
+            return {"result": {"subtype": "error"}}
+
+    @staticmethod
+    async def aget_bounding_client_rect(
+        client: ACDPSession, backend_node_id: str
+    ) -> dict[str, Any]:
+        try:
+            remote_object = await client.send(
+                "DOM.resolveNode", {"backendNodeId": int(backend_node_id)}
+            )
+            remote_object_id = remote_object["object"]["objectId"]
+            response = await client.send(
+                "Runtime.callFunctionOn",
+                {
+                    "objectId": remote_object_id,
+                    "functionDeclaration": BOUNDING_CLIENT_RECT_JS,
                     "returnByValue": True,
                 },
             )
@@ -139,6 +292,99 @@ class TextObervationProcessor(ObservationProcessor):
         except Exception as e:
             return {"result": {"subtype": "error"}}
 
+    @staticmethod
+    def parse_bounding_client_rect(
+        response: dict[str, Any]
+    ) -> list[float] | None:
+        if response.get("result", {}).get("subtype", "") == "error":
+            return None
+        x = response["result"]["value"]["x"]
+        y = response["result"]["value"]["y"]
+        width = response["result"]["value"]["width"]
+        height = response["result"]["value"]["height"]
+        return [x, y, width, height]
+
+    @staticmethod
+    def get_layout_bounds(info: BrowserInfo) -> dict[int, list[float]]:
+        """Map the node index in the DOM snapshot to its bounding client rect
+
+        The layout bounds in the snapshot are in document coordinates, they
+        are shifted by the scroll offset to match `getBoundingClientRect`.
+        """
+        config = info["config"]
+        layout = info["DOMTree"]["documents"][0]["layout"]
+        layout_bounds: dict[int, list[float]] = {}
+        for node_idx, bound in zip(layout["nodeIndex"], layout["bounds"]):
+            if node_idx in layout_bounds:
+                continue
+            x, y, width, height = bound
+            layout_bounds[node_idx] = [
+                x - config["win_left_bound"],
+                y - config["win_top_bound"],
+                width,
+                height,
+            ]
+        return layout_bounds
+
+    def get_bounding_client_rects(
+        self,
+        client: CDPSession,
+        backend_node_ids: list[str],
+        info: BrowserInfo,
+    ) -> dict[str, list[float] | None]:
+        """Resolve the bounding client rects of a batch of nodes
+
+        The rects are read from the DOM snapshot captured in
+        `fetch_browser_info` instead of two CDP calls per node. Nodes without
+        a layout object (e.g. display: none) get an empty rect, nodes missing
+        from the snapshot fall back to `get_bounding_client_rect`.
+        """
+        snapshot_bounds = self.get_snapshot_bounds(info)
+        bounds: dict[str, list[float] | None] = {}
+        for backend_node_id in backend_node_ids:
+            if backend_node_id in snapshot_bounds:
+                bounds[backend_node_id] = snapshot_bounds[backend_node_id]
+                continue
+            response = self.get_bounding_client_rect(client, backend_node_id)
+            bounds[backend_node_id] = self.parse_bounding_client_rect(response)
+        return bounds
+
+    async def aget_bounding_client_rects(
+        self,
+        client: ACDPSession,
+        backend_node_ids: list[str],
+        info: BrowserInfo,
+    ) -> dict[str, list[float] | None]:
+        snapshot_bounds = self.get_snapshot_bounds(info)
+        bounds: dict[str, list[float] | None] = {}
+        missing_ids = []
+        for backend_node_id in backend_node_ids:
+            if backend_node_id in snapshot_bounds:
+                bounds[backend_node_id] = snapshot_bounds[backend_node_id]
+            else:
+                missing_ids.append(backend_node_id)
+        # the nodes missing from the snapshot are resolved concurrently
+        responses = await asyncio.gather(
+            *[
+                self.aget_bounding_client_rect(client, backend_node_id)
+                for backend_node_id in missing_ids
+            ]
+        )
+        for backend_node_id, response in zip(missing_ids, responses):
+            bounds[backend_node_id] = self.parse_bounding_client_rect(response)
+        return bounds
+
+    def get_snapshot_bounds(self, info: BrowserInfo) -> dict[str, list[float]]:
+        """Map the backend node ids in the DOM snapshot to their bounds"""
+        nodes = info["DOMTree"]["documents"][0]["nodes"]
+        layout_bounds = self.get_layout_bounds(info)
+        snapshot_bounds: dict[str, list[float]] = {}
+        for node_idx, backend_node_id in enumerate(nodes["backendNodeId"]):
+            snapshot_bounds[str(backend_node_id)] = layout_bounds.get(
+                node_idx, [0.0, 0.0, 0.0, 0.0]
+            )
+        return snapshot_bounds
+
     @staticmethod
     def get_element_in_viewport_ratio(
         elem_left_bound: float,
@@ -171,6 +417,59 @@ class TextObervationProcessor(ObservationProcessor):
         ratio = overlap_width * overlap_height / width * height
         return ratio
 
+    @staticmethod
+    def get_elements_in_viewport_ratio(
+        bounds: npt.NDArray[np.float64], config: BrowserConfig
+    ) -> npt.NDArray[np.float64]:
+        """Vectorized `get_element_in_viewport_ratio` over (N, 4) bounds"""
+        elem_left_bound = bounds[:, 0]
+        elem_top_bound = bounds[:, 1]
+        width = bounds[:, 2]
+        height = bounds[:, 3]
+        elem_right_bound = elem_left_bound + width
+        elem_lower_bound = elem_top_bound + height
+
+        overlap_width = np.maximum(
+            0,
+            np.minimum(elem_right_bound, config["win_width"])
+            - np.maximum(elem_left_bound, 0),
+        )
+        overlap_height = np.maximum(
+            0,
+            np.minimum(elem_lower_bound, config["win_height"])
+            - np.maximum(elem_top_bound, 0),
+        )
+
+        # same operator precedence as get_element_in_viewport_ratio
+        ratio: npt.NDArray[np.float64] = (
+            overlap_width * overlap_height / width * height
+        )
+        return ratio
+
+    def get_out_of_viewport_mask(
+        self, union_bounds: list[list[float] | None], config: BrowserConfig
+    ) -> list[bool]:
+        """Whether each node is invisible or not in the current viewport"""
+        has_bound = np.array(
+            [bool(bound) for bound in union_bounds], dtype=np.bool_
+        )
+        bounds = np.array(
+            [
+                bound if bound else [0.0, 0.0, 0.0, 0.0]
+                for bound in union_bounds
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 4)
+        # invisible node
+        visible = has_bound & (bounds[:, 2] != 0) & (bounds[:, 3] != 0)
+
+        in_viewport_ratio = np.zeros(len(union_bounds), dtype=np.float64)
+        in_viewport_ratio[visible] = self.get_elements_in_viewport_ratio(
+            bounds[visible], config
+        )
+        removed = ~visible | (in_viewport_ratio < IN_VIEWPORT_RATIO_THRESHOLD)
+        return removed.tolist()  # type: ignore[no-any-return]
+
     def fetch_page_html(
         self,
         info: BrowserInfo,
@@ -183,6 +482,8 @@ class TextObervationProcessor(ObservationProcessor):
         strings = tree["strings"]
         document = tree["documents"][0]
         nodes = document["nodes"]
+        # join the snapshot layout to the nodes, no extra CDP calls needed
+        layout_bounds = self.get_layout_bounds(info)
 
         # make a dom tree that is easier to navigate
         dom_tree: DOMTree = []
@@ -235,21 +536,13 @@ class TextObervationProcessor(ObservationProcessor):
             if cur_node["parentId"] != "-1":
                 graph[cur_node["parentId"]].append(str(cur_node["nodeId"]))
 
-            # get the bound
+            # get the bound, nodes without a layout object are not rendered
             if cur_node["parentId"] == "-1":
                 cur_node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
             else:
-                response = self.get_bounding_client_rect(
-                    client, cur_node["backendNodeId"]
+                cur_node["union_bound"] = layout_bounds.get(
+                    node_idx, [0.0, 0.0, 0.0, 0.0]
                 )
-                if response.get("result", {}).get("subtype", "") == "error":
-                    cur_node["union_bound"] = None
-                else:
-                    x = response["result"]["value"]["x"]
-                    y = response["result"]["value"]["y"]
-                    width = response["result"]["value"]["width"]
-                    height = response["result"]["value"]["height"]
-                    cur_node["union_bound"] = [x, y, width, height]
 
             dom_tree.append(cur_node)
 
@@ -260,55 +553,17 @@ class TextObervationProcessor(ObservationProcessor):
         # remove the nodes that are not in the current viewport
         if current_viewport_only:
 
-            def remove_node_in_graph(node: DOMNode) -> None:
-                # update the node information in the accessibility tree
-                node_id = node["nodeId"]
-                parent_id = node["parentId"]
-                child_ids = node["childIds"]
-
-                # update the children of the parent node
-                assert dom_tree[int(parent_id)]["parentId"] != "[REMOVED]"
-                # remove the nodeid from parent
-                index = dom_tree[int(parent_id)]["childIds"].index(node_id)
-                dom_tree[int(parent_id)]["childIds"].pop(index)
-
-                # Insert children_nodeids in the same location
-                for child_id in child_ids:
-                    dom_tree[int(parent_id)]["childIds"].insert(
-                        index, child_id
-                    )
-                    index += 1
-
-                # update children node's parent
-                for child_id in child_ids:
-                    dom_tree[int(child_id)]["parentId"] = parent_id
-                # mark as removed
-                dom_tree[int(node_id)]["parentId"] = "[REMOVED]"
-
-            config = info["config"]
-            for cursor, node in enumerate(dom_tree):
-                if not node["union_bound"]:
-                    remove_node_in_graph(node)
-                    continue
-
-                [x, y, width, height] = node["union_bound"]
-
-                # invisible node
-                if width == 0.0 or height == 0.0:
-                    remove_node_in_graph(node)
-                    continue
-
-                in_viewport_ratio = self.get_element_in_viewport_ratio(
-                    elem_left_bound=float(x),
-                    elem_top_bound=float(y),
-                    width=float(width),
-                    height=float(height),
-                    config=config,
-                )
-
-                if in_viewport_ratio < IN_VIEWPORT_RATIO_THRESHOLD:
-                    remove_node_in_graph(node)
-
+            removed = self.get_out_of_viewport_mask(
+                [node["union_bound"] for node in dom_tree], info["config"]
+            )
+            remove_nodes_from_tree(
+                dom_tree,  # type: ignore[arg-type]
+                removed,
+                {
+                    node["nodeId"]: cursor
+                    for cursor, node in enumerate(dom_tree)
+                },
+            )
             dom_tree = [
                 node
                 for node in dom_tree
@@ -318,7 +573,9 @@ class TextObervationProcessor(ObservationProcessor):
         return dom_tree
 
     @staticmethod
-    def parse_html(dom_tree: DOMTree) -> tuple[str, dict[str, Any]]:
+    def parse_html(
+        dom_tree: DOMTree,
+    ) -> tuple[str, dict[str, Any]]:
         """Parse the html tree into a string text"""
 
         obs_nodes_info = {}
@@ -326,8 +583,11 @@ class TextObervationProcessor(ObservationProcessor):
             node["nodeId"]: idx for idx, node in enumerate(dom_tree)
         }
 
-        def dfs(node_cursor: int, depth: int) -> str:
-            tree_str = ""
+        # iterative pre-order traversal, the lines are joined once at the end
+        lines: list[str] = []
+        stack = [(0, 0)]
+        while stack:
+            node_cursor, depth = stack.pop()
             node = dom_tree[node_cursor]
             indent = "\t" * depth
             valid_node = True
@@ -344,32 +604,331 @@ class TextObervationProcessor(ObservationProcessor):
                         "union_bound": node["union_bound"],
                         "text": node_str,
                     }
-                    tree_str += f"{indent}{node_str}\n"
+                    lines.append(f"{indent}{node_str}\n")
 
             except Exception as e:
                 valid_node = False
 
-            for child_ids in node["childIds"]:
-                child_cursor = nodeid_to_cursor[child_ids]
-                child_depth = depth + 1 if valid_node else depth
-                child_str = dfs(child_cursor, child_depth)
-                tree_str += child_str
-
-            return tree_str
+            child_depth = depth + 1 if valid_node else depth
+            # push in reverse so that the first child is visited first
+            for child_ids in reversed(node["childIds"]):
+                stack.append((nodeid_to_cursor[child_ids], child_depth))
 
-        html = dfs(0, 0)
+        html = "".join(lines)
         return html, obs_nodes_info
 
+    def on_ax_nodes_updated(self, event: dict[str, Any]) -> None:
+        self.updated_ax_nodes.extend(event["nodes"])
+
+    def on_ax_load_complete(self, event: dict[str, Any]) -> None:
+        # a new document is loaded
+        self.ax_node_cache = None
+
+    def add_accessibility_listeners(
+        self, client: CDPSession | ACDPSession
+    ) -> bool:
+        """Listen to the accessibility updates of `client`, instead of the
+        client of the previous page, False if it is already listened to"""
+        if client is self.ax_cache_client:
+            return False
+        self.stop_accessibility_updates()
+        self.ax_cache_client = client
+        client.on("Accessibility.nodesUpdated", self.on_ax_nodes_updated)
+        client.on("Accessibility.loadComplete", self.on_ax_load_complete)
+        return True
+
+    def listen_accessibility_updates(self, client: CDPSession) -> None:
+        if self.add_accessibility_listeners(client):
+            # the events are only sent once the domain is enabled
+            client.send("Accessibility.enable", {})
+
+    async def alisten_accessibility_updates(self, client: ACDPSession) -> None:
+        if self.add_accessibility_listeners(client):
+            await client.send("Accessibility.enable", {})
+
+    def stop_accessibility_updates(self) -> None:
+        client = self.ax_cache_client
+        if client is not None:
+            try:
+                client.remove_listener(
+                    "Accessibility.nodesUpdated", self.on_ax_nodes_updated
+                )
+                client.remove_listener(
+                    "Accessibility.loadComplete", self.on_ax_load_complete
+                )
+            except Exception:
+                # the session is already detached
+                pass
+        self.ax_cache_client = None
+        self.ax_node_cache = None
+        self.updated_ax_nodes = []
+
+    def set_ax_node_cache(self, nodes: AccessibilityTree) -> None:
+        # the updates received before the response are already in the tree
+        self.updated_ax_nodes = []
+        self.ax_node_cache = {}
+        for node in nodes:
+            self.ax_node_cache.setdefault(node["nodeId"], node)
+        self.ax_cache_steps = 0
+        self.drop_unreachable_ax_nodes()
+
+    def fetch_full_accessibility_tree(self, client: CDPSession) -> None:
+        self.set_ax_node_cache(
+            client.send("Accessibility.getFullAXTree", {})["nodes"]
+        )
+
+    async def afetch_full_accessibility_tree(
+        self, client: ACDPSession
+    ) -> None:
+        self.set_ax_node_cache(
+            (await client.send("Accessibility.getFullAXTree", {}))["nodes"]
+        )
+
+    def drop_unreachable_ax_nodes(self) -> None:
+        """Drop the cached nodes that are not in the tree anymore"""
+        assert self.ax_node_cache is not None
+        nodes = list(self.ax_node_cache.values())
+        reachable = {nodes[0]["nodeId"]}
+        stack = [nodes[0]]
+        while stack:
+            node = stack.pop()
+            for child_id in node.get("childIds", []):
+                if (
+                    child_id in self.ax_node_cache
+                    and child_id not in reachable
+                ):
+                    reachable.add(child_id)
+                    stack.append(self.ax_node_cache[child_id])
+        self.ax_node_cache = {
+            node["nodeId"]: node
+            for node in nodes
+            if node["nodeId"] in reachable
+        }
+
+    def apply_ax_node_updates(self) -> None:
+        assert self.ax_node_cache is not None
+        for node in self.updated_ax_nodes:
+            self.ax_node_cache[node["nodeId"]] = node
+        self.updated_ax_nodes = []
+        self.ax_cache_steps += 1
+
+    def has_missing_ax_children(self, node: AccessibilityTreeNode) -> bool:
+        assert self.ax_node_cache is not None
+        return any(
+            child_id not in self.ax_node_cache
+            for child_id in node.get("childIds", [])
+        )
+
+    def add_ax_children(
+        self,
+        children: AccessibilityTree,
+        stack: list[AccessibilityTreeNode],
+    ) -> None:
+        assert self.ax_node_cache is not None
+        for child in children:
+            if child["nodeId"] not in self.ax_node_cache:
+                self.ax_node_cache[child["nodeId"]] = child
+                stack.append(child)
+
+    def has_stale_ax_nodes(self, removed_backend_ids: set[int]) -> bool:
+        """Whether a cached node belongs to a removed DOM node, its update
+        was missed"""
+        assert self.ax_node_cache is not None
+        return any(
+            int(node["backendDOMNodeId"]) in removed_backend_ids
+            for node in self.ax_node_cache.values()
+            if "backendDOMNodeId" in node
+        )
+
+    def patch_accessibility_tree(
+        self, client: CDPSession, removed_backend_ids: set[int]
+    ) -> bool:
+        """Apply the updates to the cached tree and fetch the new children,
+        False when the patched tree cannot be trusted"""
+        assert self.ax_node_cache is not None
+        self.apply_ax_node_updates()
+
+        # fetch the new children, each parent is queried once
+        queried_ids = set()
+        stack = list(self.ax_node_cache.values())
+        while stack:
+            node = stack.pop()
+            if (
+                not self.has_missing_ax_children(node)
+                or node["nodeId"] in queried_ids
+            ):
+                continue
+            queried_ids.add(node["nodeId"])
+            try:
+                children = client.send(
+                    "Accessibility.getChildAXNodes", {"id": node["nodeId"]}
+                )["nodes"]
+            except Exception:
+                return False
+            self.add_ax_children(children, stack)
+
+        self.drop_unreachable_ax_nodes()
+        return not self.has_stale_ax_nodes(removed_backend_ids)
+
+    async def apatch_accessibility_tree(
+        self, client: ACDPSession, removed_backend_ids: set[int]
+    ) -> bool:
+        assert self.ax_node_cache is not None
+        self.apply_ax_node_updates()
+
+        queried_ids = set()
+        stack = list(self.ax_node_cache.values())
+        while stack:
+            node = stack.pop()
+            if (
+                not self.has_missing_ax_children(node)
+                or node["nodeId"] in queried_ids
+            ):
+                continue
+            queried_ids.add(node["nodeId"])
+            try:
+                children = (
+                    await client.send(
+                        "Accessibility.getChildAXNodes",
+                        {"id": node["nodeId"]},
+                    )
+                )["nodes"]
+            except Exception:
+                return False
+            self.add_ax_children(children, stack)
+
+        self.drop_unreachable_ax_nodes()
+        return not self.has_stale_ax_nodes(removed_backend_ids)
+
+    def update_dom_snapshot(self, info: BrowserInfo) -> tuple[bool, set[int]]:
+        """Whether the DOM changed since the previous step and the backend
+        ids of its removed nodes"""
+        dom_fingerprint = get_dom_fingerprint(info)
+        dom_changed = dom_fingerprint != self.dom_fingerprint
+        self.dom_fingerprint = dom_fingerprint
+        dom_backend_ids = {
+            backend_id
+            for document in info["DOMTree"]["documents"]
+            for backend_id in document["nodes"]["backendNodeId"]
+        }
+        removed_backend_ids = self.dom_backend_ids - dom_backend_ids
+        self.dom_backend_ids = dom_backend_ids
+        return dom_changed, removed_backend_ids
+
+    def can_patch_accessibility_tree(self, dom_changed: bool) -> bool:
+        return (
+            self.ax_node_cache is not None
+            and self.ax_cache_steps < self.max_incremental_steps
+            and not (dom_changed and not self.updated_ax_nodes)
+        )
+
+    def copy_ax_node_cache(self) -> AccessibilityTree:
+        assert self.ax_node_cache is not None
+        # the tree is modified by the viewport filtering, copy the nodes
+        return [
+            {**node, "childIds": list(node.get("childIds", []))}
+            for node in self.ax_node_cache.values()
+        ]
+
+    def fetch_incremental_accessibility_tree(
+        self, client: CDPSession, info: BrowserInfo
+    ) -> AccessibilityTree:
+        """Patch the cached accessibility tree with the updated nodes
+
+        The updates are the `Accessibility.nodesUpdated` events received so
+        far. The browser does not guarantee that the updates of every change
+        made before the observation were received, so the whole tree is
+        fetched again when the updates cannot be trusted: on a new page or
+        document, when the DOM changed but no update was received, when a
+        node of a removed DOM node is still cached, when the new children
+        cannot be fetched, and every `max_incremental_steps` steps.
+        """
+        self.listen_accessibility_updates(client)
+        dom_changed, removed_backend_ids = self.update_dom_snapshot(info)
+        if not self.can_patch_accessibility_tree(
+            dom_changed
+        ) or not self.patch_accessibility_tree(client, removed_backend_ids):
+            self.fetch_full_accessibility_tree(client)
+        return self.copy_ax_node_cache()
+
+    async def afetch_incremental_accessibility_tree(
+        self, client: ACDPSession, info: BrowserInfo
+    ) -> AccessibilityTree:
+        await self.alisten_accessibility_updates(client)
+        dom_changed, removed_backend_ids = self.update_dom_snapshot(info)
+        if not self.can_patch_accessibility_tree(
+            dom_changed
+        ) or not await self.apatch_accessibility_tree(
+            client, removed_backend_ids
+        ):
+            await self.afetch_full_accessibility_tree(client)
+        return self.copy_ax_node_cache()
+
     def fetch_page_accessibility_tree(
         self,
         info: BrowserInfo,
         client: CDPSession,
         current_viewport_only: bool,
     ) -> AccessibilityTree:
-        accessibility_tree: AccessibilityTree = client.send(
-            "Accessibility.getFullAXTree", {}
-        )["nodes"]
+        accessibility_tree: AccessibilityTree
+        if self.incremental:
+            accessibility_tree = self.fetch_incremental_accessibility_tree(
+                client, info
+            )
+        else:
+            accessibility_tree = client.send(
+                "Accessibility.getFullAXTree", {}
+            )["nodes"]
+        accessibility_tree = self.remove_duplicate_nodes(accessibility_tree)
+
+        # resolve the bounds of all nodes in one batch
+        bounds = self.get_bounding_client_rects(
+            client,
+            [
+                str(node["backendDOMNodeId"])
+                for node in accessibility_tree
+                if "backendDOMNodeId" in node
+            ],
+            info,
+        )
+        return self.prune_accessibility_tree(
+            accessibility_tree, bounds, info, current_viewport_only
+        )
 
+    async def afetch_page_accessibility_tree(
+        self,
+        info: BrowserInfo,
+        client: ACDPSession,
+        current_viewport_only: bool,
+    ) -> AccessibilityTree:
+        accessibility_tree: AccessibilityTree
+        if self.incremental:
+            accessibility_tree = (
+                await self.afetch_incremental_accessibility_tree(client, info)
+            )
+        else:
+            accessibility_tree = (
+                await client.send("Accessibility.getFullAXTree", {})
+            )["nodes"]
+        accessibility_tree = self.remove_duplicate_nodes(accessibility_tree)
+
+        bounds = await self.aget_bounding_client_rects(
+            client,
+            [
+                str(node["backendDOMNodeId"])
+                for node in accessibility_tree
+                if "backendDOMNodeId" in node
+            ],
+            info,
+        )
+        return self.prune_accessibility_tree(
+            accessibility_tree, bounds, info, current_viewport_only
+        )
+
+    @staticmethod
+    def remove_duplicate_nodes(
+        accessibility_tree: AccessibilityTree,
+    ) -> AccessibilityTree:
         # a few nodes are repeated in the accessibility tree
         seen_ids = set()
         _accessibility_tree = []
@@ -377,8 +936,16 @@ class TextObervationProcessor(ObservationProcessor):
             if node["nodeId"] not in seen_ids:
                 _accessibility_tree.append(node)
                 seen_ids.add(node["nodeId"])
-        accessibility_tree = _accessibility_tree
+        return _accessibility_tree
 
+    def prune_accessibility_tree(
+        self,
+        accessibility_tree: AccessibilityTree,
+        bounds: dict[str, list[float] | None],
+        info: BrowserInfo,
+        current_viewport_only: bool,
+    ) -> AccessibilityTree:
+        """Attach the bounds to the nodes and drop the invisible ones"""
         nodeid_to_cursor = {}
         for cursor, node in enumerate(accessibility_tree):
             nodeid_to_cursor[node["nodeId"]] = cursor
@@ -391,76 +958,20 @@ class TextObervationProcessor(ObservationProcessor):
                 # always inside the viewport
                 node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
             else:
-                response = self.get_bounding_client_rect(
-                    client, backend_node_id
-                )
-                if response.get("result", {}).get("subtype", "") == "error":
-                    node["union_bound"] = None
-                else:
-                    x = response["result"]["value"]["x"]
-                    y = response["result"]["value"]["y"]
-                    width = response["result"]["value"]["width"]
-                    height = response["result"]["value"]["height"]
-                    node["union_bound"] = [x, y, width, height]
+                node["union_bound"] = bounds[backend_node_id]
 
         # filter nodes that are not in the current viewport
         if current_viewport_only:
 
-            def remove_node_in_graph(node: AccessibilityTreeNode) -> None:
-                # update the node information in the accessibility tree
-                nodeid = node["nodeId"]
-                node_cursor = nodeid_to_cursor[nodeid]
-                parent_nodeid = node["parentId"]
-                children_nodeids = node["childIds"]
-                parent_cursor = nodeid_to_cursor[parent_nodeid]
-                # update the children of the parent node
-                assert (
-                    accessibility_tree[parent_cursor].get("parentId", "Root")
-                    is not None
-                )
-                # remove the nodeid from parent's childIds
-                index = accessibility_tree[parent_cursor]["childIds"].index(
-                    nodeid
-                )
-                accessibility_tree[parent_cursor]["childIds"].pop(index)
-                # Insert children_nodeids in the same location
-                for child_nodeid in children_nodeids:
-                    accessibility_tree[parent_cursor]["childIds"].insert(
-                        index, child_nodeid
-                    )
-                    index += 1
-                # update children node's parent
-                for child_nodeid in children_nodeids:
-                    child_cursor = nodeid_to_cursor[child_nodeid]
-                    accessibility_tree[child_cursor][
-                        "parentId"
-                    ] = parent_nodeid
-                # mark as removed
-                accessibility_tree[node_cursor]["parentId"] = "[REMOVED]"
-
-            config = info["config"]
-            for node in accessibility_tree:
-                if not node["union_bound"]:
-                    remove_node_in_graph(node)
-                    continue
-
-                [x, y, width, height] = node["union_bound"]
-
-                # invisible node
-                if width == 0 or height == 0:
-                    remove_node_in_graph(node)
-                    continue
-
-                in_viewport_ratio = self.get_element_in_viewport_ratio(
-                    elem_left_bound=float(x),
-                    elem_top_bound=float(y),
-                    width=float(width),
-                    height=float(height),
-                    config=config,
-                )
-
-                if in_viewport_ratio < IN_VIEWPORT_RATIO_THRESHOLD:
-                    remove_node_in_graph(node)
+            removed = self.get_out_of_viewport_mask(
+                [node["union_bound"] for node in accessibility_tree],
+                info["config"],
+            )
+            remove_nodes_from_tree(
+                accessibility_tree,  # type: ignore[arg-type]
+                removed,
+                nodeid_to_cursor,
+            )
 
             accessibility_tree = [
                 node
@@ -481,8 +992,11 @@ class TextObervationProcessor(ObservationProcessor):
 
         obs_nodes_info = {}
 
-        def dfs(idx: int, obs_node_id: str, depth: int) -> str:
-            tree_str = ""
+        # iterative pre-order traversal, the lines are joined once at the end
+        lines: list[str] = []
+        stack = [(0, accessibility_tree[0]["nodeId"], 0)]
+        while stack:
+            idx, obs_node_id, depth = stack.pop()
             node = accessibility_tree[idx]
             indent = "\t" * depth
             valid_node = True
@@ -529,7 +1043,7 @@ class TextObervationProcessor(ObservationProcessor):
                         valid_node = False
 
                 if valid_node:
-                    tree_str += f"{indent}{node_str}"
+                    lines.append(f"{indent}{node_str}")
                     obs_nodes_info[obs_node_id] = {
                         "backend_id": node["backendDOMNodeId"],
                         "union_bound": node["union_bound"],
@@ -539,22 +1053,17 @@ class TextObervationProcessor(ObservationProcessor):
             except Exception as e:
                 valid_node = False
 
-            for _, child_node_id in enumerate(node["childIds"]):
+            # mark this to save some tokens
+            child_depth = depth + 1 if valid_node else depth
+            # push in reverse so that the first child is visited first
+            for child_node_id in reversed(node["childIds"]):
                 if child_node_id not in node_id_to_idx:
                     continue
-                # mark this to save some tokens
-                child_depth = depth + 1 if valid_node else depth
-                child_str = dfs(
-                    node_id_to_idx[child_node_id], child_node_id, child_depth
+                stack.append(
+                    (node_id_to_idx[child_node_id], child_node_id, child_depth)
                 )
-                if child_str.strip():
-                    if tree_str.strip():
-                        tree_str += "\n"
-                    tree_str += child_str
-
-            return tree_str
 
-        tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
+        tree_str = "\n".join(lines)
         return tree_str, obs_nodes_info
 
     @staticmethod
@@ -580,20 +1089,22 @@ class TextObervationProcessor(ObservationProcessor):
 
         return "\n".join(clean_lines)
 
+    @staticmethod
+    def get_tab_title_str(tab_titles: list[str], current_tab_idx: int) -> str:
+        for idx in range(len(tab_titles)):
+            if idx == current_tab_idx:
+                tab_titles[idx] = f"Tab {idx} (current): {tab_titles[idx]}"
+            else:
+                tab_titles[idx] = f"Tab {idx}: {tab_titles[idx]}"
+        return " | ".join(tab_titles)
+
     def process(self, page: Page, client: CDPSession) -> str:
         # get the tab info
         open_tabs = page.context.pages
         try:
             tab_titles = [tab.title() for tab in open_tabs]
             current_tab_idx = open_tabs.index(page)
-            for idx in range(len(open_tabs)):
-                if idx == current_tab_idx:
-                    tab_titles[
-                        idx
-                    ] = f"Tab {idx} (current): {open_tabs[idx].title()}"
-                else:
-                    tab_titles[idx] = f"Tab {idx}: {open_tabs[idx].title()}"
-            tab_title_str = " | ".join(tab_titles)
+            tab_title_str = self.get_tab_title_str(tab_titles, current_tab_idx)
         except Exception:
             tab_title_str = " | ".join(
                 ["Tab {idx}" for idx in range(len(open_tabs))]
@@ -605,39 +1116,95 @@ class TextObervationProcessor(ObservationProcessor):
             page.wait_for_load_state("load", timeout=500)
             browser_info = self.fetch_browser_info(page, client)
 
+        tree: DOMTree | AccessibilityTree
         if self.observation_type == "html":
-            dom_tree = self.fetch_page_html(
+            tree = self.fetch_page_html(
                 browser_info,
                 page,
                 client,
                 current_viewport_only=self.current_viewport_only,
             )
-            content, obs_nodes_info = self.parse_html(dom_tree)
-            self.obs_nodes_info = obs_nodes_info
-            self.meta_data["obs_nodes_info"] = obs_nodes_info
-
         elif self.observation_type == "accessibility_tree":
-            accessibility_tree = self.fetch_page_accessibility_tree(
+            tree = self.fetch_page_accessibility_tree(
                 browser_info,
                 client,
                 current_viewport_only=self.current_viewport_only,
             )
-            content, obs_nodes_info = self.parse_accessibility_tree(
-                accessibility_tree
+        else:
+            raise ValueError(
+                f"Invalid observatrion type: {self.observation_type}"
             )
-            content = self.clean_accesibility_tree(content)
-            self.obs_nodes_info = obs_nodes_info
-            self.meta_data["obs_nodes_info"] = obs_nodes_info
 
+        content = self.parse_tree(tree, browser_info)
+        content = f"{tab_title_str}\n\n{content}"
+        return content
+
+    async def aprocess(self, page: APage, client: ACDPSession) -> str:
+        # get the tab info
+        open_tabs = page.context.pages
+        try:
+            tab_titles = [await tab.title() for tab in open_tabs]
+            current_tab_idx = open_tabs.index(page)
+            tab_title_str = self.get_tab_title_str(tab_titles, current_tab_idx)
+        except Exception:
+            tab_title_str = " | ".join(
+                ["Tab {idx}" for idx in range(len(open_tabs))]
+            )
+
+        try:
+            browser_info = await self.afetch_browser_info(page, client)
+        except Exception:
+            await page.wait_for_load_state("load", timeout=500)
+            browser_info = await self.afetch_browser_info(page, client)
+
+        tree: DOMTree | AccessibilityTree
+        if self.observation_type == "html":
+            # only reads the DOM snapshot of browser_info
+            tree = self.fetch_page_html(
+                browser_info,
+                page,  # type: ignore[arg-type]
+                client,  # type: ignore[arg-type]
+                current_viewport_only=self.current_viewport_only,
+            )
+        elif self.observation_type == "accessibility_tree":
+            tree = await self.afetch_page_accessibility_tree(
+                browser_info,
+                client,
+                current_viewport_only=self.current_viewport_only,
+            )
         else:
             raise ValueError(
                 f"Invalid observatrion type: {self.observation_type}"
             )
 
-        self.browser_config = browser_info["config"]
+        content = self.parse_tree(tree, browser_info)
         content = f"{tab_title_str}\n\n{content}"
         return content
 
+    def parse_tree(
+        self, tree: DOMTree | AccessibilityTree, browser_info: BrowserInfo
+    ) -> str:
+        """Serialize the fetched tree and update the observation metadata"""
+        prev_obs_nodes_info = self.obs_nodes_info
+
+        if self.observation_type == "html":
+            content, obs_nodes_info = self.parse_html(tree)  # type: ignore[arg-type]
+        else:
+            content, obs_nodes_info = self.parse_accessibility_tree(
+                tree  # type: ignore[arg-type]
+            )
+            content = self.clean_accesibility_tree(content)
+        self.obs_nodes_info = obs_nodes_info
+        self.meta_data["obs_nodes_info"] = obs_nodes_info
+
+        if self.incremental:
+            self.meta_data["obs_diff"] = get_observation_diff(
+                prev_obs_nodes_info, obs_nodes_info
+            )
+
+        self.browser_config = browser_info["config"]
+        return content
+
     def get_element_center(self, element_id: str) -> tuple[float, float]:
         node_info = self.obs_nodes_info[element_id]
         node_bound = node_info["union_bound"]
@@ -664,6 +1231,44 @@ class ImageObservationProcessor(ObservationProcessor):
             screenshot = png_bytes_to_numpy(page.screenshot())
         return screenshot
 
+    async def aprocess(
+        self, page: APage, client: ACDPSession
+    ) -> npt.NDArray[np.uint8]:
+        try:
+            screenshot = png_bytes_to_numpy(await page.screenshot())
+        except:
+            await page.wait_for_event("load")
+            screenshot = png_bytes_to_numpy(await page.screenshot())
+        return screenshot
+
+
+class LazyObservation(dict[str, Observation]):
+    """Observation whose modalities are computed on their first access
+
+    The modalities can only be computed while the page is unchanged, `expire`
+    drops the ones that have not been accessed yet.
+    """
+
+    def __init__(self, loaders: dict[str, Callable[[], Observation]]) -> None:
+        super().__init__()
+        self.loaders = loaders
+        self.expired_keys: set[str] = set()
+
+    def __missing__(self, key: str) -> Observation:
+        if key in self.expired_keys:
+            raise KeyError(
+                f"The {key} observation was not accessed before the page changed"
+            )
+        if key not in self.loaders:
+            raise KeyError(key)
+        value = self.loaders.pop(key)()
+        self[key] = value
+        return value
+
+    def expire(self) -> None:
+        self.expired_keys.update(self.loaders)
+        self.loaders = {}
+
 
 class ObservationHandler:
     """Main entry point to access all observation processor"""
@@ -675,15 +1280,20 @@ class ObservationHandler:
         image_observation_type: str,
         current_viewport_only: bool,
         viewport_size: ViewportSize,
+        incremental_observation: bool = False,
     ) -> None:
         self.main_observation_type = main_observation_type
         self.text_processor = TextObervationProcessor(
-            text_observation_type, current_viewport_only, viewport_size
+            text_observation_type,
+            current_viewport_only,
+            viewport_size,
+            incremental=incremental_observation,
         )
         self.image_processor = ImageObservationProcessor(
             image_observation_type
         )
         self.viewport_size = viewport_size
+        self.observation: LazyObservation | None = None
 
     def get_observation_space(self) -> spaces.Dict:
         text_space = spaces.Text(
@@ -711,9 +1321,38 @@ class ObservationHandler:
     def get_observation(
         self, page: Page, client: CDPSession
     ) -> dict[str, Observation]:
-        text_obs = self.text_processor.process(page, client)
-        image_obs = self.image_processor.process(page, client)
-        return {"text": text_obs, "image": image_obs}
+        """Only the main observation is computed eagerly, the others (e.g.
+        the screenshot of a text-based agent) are computed when accessed"""
+        self.expire_observation()
+        observation = LazyObservation(
+            {
+                "text": lambda: self.text_processor.process(page, client),
+                "image": lambda: self.image_processor.process(page, client),
+            }
+        )
+        # needed to execute the actions, e.g., the element ids
+        observation[self.main_observation_type]
+        self.observation = observation
+        return observation
+
+    async def aget_observation(
+        self, page: APage, client: ACDPSession
+    ) -> dict[str, Observation]:
+        """Only the main observation is computed, the lazy modalities need
+        the sync api"""
+        self.expire_observation()
+        observation = LazyObservation({})
+        observation[
+            self.main_observation_type
+        ] = await self.action_processor.aprocess(page, client)
+        self.observation = observation
+        return observation
+
+    def expire_observation(self) -> None:
+        """Called before the page changes"""
+        if self.observation is not None:
+            self.observation.expire()
+            self.observation = None
 
     def get_observation_metadata(self) -> dict[str, ObservationMetadata]:
         return {
@@ -0,0 +1,100 @@
+"""Schedule the evaluation tasks under per-site concurrency limits"""
+import argparse
+import json
+from collections import defaultdict
+
+# how many tasks can hit each backend at the same time
+DEFAULT_SITE_CONCURRENCY = {
+    "shopping": 4,
+    "shopping_admin": 3,
+    "gitlab": 2,
+    "reddit": 3,
+    "wikipedia": 4,
+    "map": 4,
+}
+
+
+def get_task_sites(config_file: str) -> list[str]:
+    with open(config_file, "r") as f:
+        sites: list[str] = json.load(f).get("sites", [])
+    return sites
+
+
+def parse_site_limit(site_limit: str) -> tuple[str, int]:
+    """Parse a `site=limit` argument of `--site_concurrency`"""
+    site, sep, limit = site_limit.partition("=")
+    if not sep or not site:
+        raise argparse.ArgumentTypeError(
+            f"Expected site=limit, got {site_limit!r}"
+        )
+    try:
+        value = int(limit)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"The concurrency limit of {site} must be an integer, got {limit!r}"
+        )
+    if value < 1:
+        raise argparse.ArgumentTypeError(
+            f"The concurrency limit of {site} must be at least 1"
+        )
+    return site, value
+
+
+class SiteScheduler:
+    """Pick the next task to run so that no backend is over its limit
+
+    A task can start when every site it declares runs fewer tasks than its
+    concurrency limit. Among those, the task whose busiest site is the least
+    loaded goes first, which interleaves the tasks of the different backends
+    instead of running them site by site. Ties keep the order of submission.
+    Sites without a limit are not constrained.
+    """
+
+    def __init__(self, site_concurrency: dict[str, int]) -> None:
+        for site, limit in site_concurrency.items():
+            if limit < 1:
+                raise ValueError(
+                    f"The concurrency limit of {site} must be at least 1"
+                )
+        self.site_concurrency = site_concurrency
+        self.pending: list[tuple[str, list[str]]] = []
+        self.running: dict[str, list[str]] = {}
+        self.site_load: dict[str, int] = defaultdict(int)
+
+    def add(self, task: str, sites: list[str]) -> None:
+        self.pending.append((task, sites))
+
+    def load(self, site: str) -> float:
+        if site not in self.site_concurrency:
+            return 0.0
+        return self.site_load[site] / self.site_concurrency[site]
+
+    def next_task(self) -> str | None:
+        """Start the next task, None if no task can start now"""
+        best_idx = None
+        best_load = float("inf")
+        for idx, (_, sites) in enumerate(self.pending):
+            loads = [self.load(site) for site in sites]
+            if any(load >= 1 for load in loads):
+                continue
+            load = max(loads, default=0.0)
+            if load < best_load:
+                best_idx, best_load = idx, load
+                if load == 0:
+                    break
+        if best_idx is None:
+            return None
+
+        task, sites = self.pending.pop(best_idx)
+        self.running[task] = sites
+        for site in sites:
+            self.site_load[site] += 1
+        return task
+
+    def finish(self, task: str) -> None:
+        for site in self.running.pop(task):
+            self.site_load[site] -= 1
+
+    def __len__(self) -> int:
+        """The number of tasks not finished yet"""
+        return len(self.pending) + len(self.running)
@@ -0,0 +1,92 @@
+"""Wait for a page to become stable after an action instead of a fixed sleep"""
+import time
+
+from playwright.sync_api import BrowserContext, Page, Request
+
+# resolve once the DOM has not changed for `quietMs`, or after `timeoutMs`
+DOM_QUIESCENCE_JS = """
+    ([quietMs, timeoutMs]) => new Promise((resolve) => {
+        const start = performance.now();
+        let lastMutation = start;
+        const observer = new MutationObserver(() => {
+            lastMutation = performance.now();
+        });
+        observer.observe(document, {
+            childList: true,
+            subtree: true,
+            attributes: true,
+            characterData: true,
+        });
+        const check = () => {
+            const now = performance.now();
+            if (now - lastMutation >= quietMs || now - start >= timeoutMs) {
+                observer.disconnect();
+                resolve(now - start);
+            } else {
+                setTimeout(check, quietMs / 2);
+            }
+        };
+        setTimeout(check, quietMs);
+    })
+"""
+
+
+class PageSettleDetector:
+    """Detect when a page has settled after an action
+
+    A page is settled once the load event fired, there is no in-flight
+    network request in the browser context and the DOM has not mutated for
+    `quiet_period` seconds. The whole wait is capped by `timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        timeout: float,
+        quiet_period: float = 0.05,
+        poll_interval: float = 0.02,
+    ) -> None:
+        self.timeout = timeout
+        self.quiet_period = quiet_period
+        self.poll_interval = poll_interval
+        self.inflight_requests: set[Request] = set()
+
+    def attach(self, context: BrowserContext) -> None:
+        """Track the network requests of a (new) browser context"""
+        self.inflight_requests = set()
+        context.on("request", self.inflight_requests.add)
+        context.on("requestfinished", self.inflight_requests.discard)
+        context.on("requestfailed", self.inflight_requests.discard)
+
+    def wait(self, page: Page) -> float:
+        """Block until the page settles, return the time spent in seconds"""
+        start = time.perf_counter()
+        deadline = start + self.timeout
+
+        def remaining_ms() -> float:
+            # playwright treats a timeout of 0 as no timeout
+            return max(1.0, (deadline - time.perf_counter()) * 1000)
+
+        try:
+            page.wait_for_load_state("load", timeout=remaining_ms())
+
+            # the event loop of playwright only runs while waiting
+            while self.inflight_requests and time.perf_counter() < deadline:
+                page.wait_for_timeout(self.poll_interval * 1000)
+
+            while time.perf_counter() < deadline:
+                try:
+                    page.evaluate(
+                        DOM_QUIESCENCE_JS,
+                        [self.quiet_period * 1000, remaining_ms()],
+                    )
+                    break
+                except Exception:
+                    # a navigation destroyed the execution context
+                    page.wait_for_load_state(
+                        "domcontentloaded", timeout=remaining_ms()
+                    )
+        except Exception:
+            # timeout or the page is closed, use whatever we have
+            pass
+
+        return time.perf_counter() - start
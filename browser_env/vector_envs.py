@@ -0,0 +1,204 @@
+import asyncio
+from typing import Any, Coroutine, Mapping, Sequence, TypeVar
+
+import numpy as np
+import numpy.typing as npt
+from gymnasium.vector import VectorEnv
+from gymnasium.vector.utils import batch_space
+from playwright.async_api import ViewportSize, async_playwright
+
+from .actions import Action
+from .async_envs import AsyncScriptBrowserEnv
+from .utils import Observation
+
+T = TypeVar("T")
+
+
+class BrowserVectorEnv(VectorEnv):  # type: ignore[type-arg]
+    """Run `num_envs` browser environments in parallel
+
+    Every environment is an `AsyncScriptBrowserEnv` with its own browser
+    context, all the contexts live in one shared Chromium process. The
+    environments are reset and stepped concurrently on the event loop of
+    the vector environment.
+
+    The actions are either a list of `Action`, one per environment, or a
+    dict of lists as batched by gymnasium. The text observations are
+    batched as tuples and the image observations as arrays. Each info key
+    maps to an object array holding the info of every environment, so
+    `infos["observation_metadata"][i]` is what the i-th env returns on its
+    own. The environments never terminate by themselves, there is no
+    autoreset.
+    """
+
+    def __init__(
+        self,
+        num_envs: int,
+        headless: bool = True,
+        slow_mo: int = 0,
+        observation_type: str = "html",
+        current_viewport_only: bool = False,
+        viewport_size: ViewportSize = {"width": 1280, "height": 720},
+        sleep_after_execution: float = 0.0,
+    ) -> None:
+        self.num_envs = num_envs
+        self.headless = headless
+        self.slow_mo = slow_mo
+        self.loop = asyncio.new_event_loop()
+        self.launch_browser()
+
+        self.envs = [
+            AsyncScriptBrowserEnv(
+                headless=headless,
+                slow_mo=slow_mo,
+                observation_type=observation_type,
+                current_viewport_only=current_viewport_only,
+                viewport_size=viewport_size,
+                sleep_after_execution=sleep_after_execution,
+                browser=self.browser,
+            )
+            for _ in range(num_envs)
+        ]
+        self.single_observation_space = self.envs[0].observation_space
+        self.single_action_space = self.envs[0].action_space
+        self.observation_space = batch_space(
+            self.single_observation_space, num_envs
+        )
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.closed = False
+
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        return self.loop.run_until_complete(coroutine)
+
+    def launch_browser(self) -> None:
+        async def _launch() -> None:
+            self.context_manager = async_playwright()
+            self.playwright = await self.context_manager.__aenter__()
+            self.browser = await self.playwright.chromium.launch(
+                headless=self.headless, slow_mo=self.slow_mo
+            )
+
+        self.run(_launch())
+
+    def split_actions(
+        self, actions: Sequence[Action] | Mapping[str, Sequence[Any]]
+    ) -> list[Action]:
+        if isinstance(actions, Mapping):
+            return [
+                {key: value[idx] for key, value in actions.items()}  # type: ignore[misc]
+                for idx in range(self.num_envs)
+            ]
+        return list(actions)
+
+    def split_options(
+        self, options: dict[str, Any] | None
+    ) -> list[dict[str, Any] | None]:
+        """The option values given as sequences are per environment"""
+        if options is None:
+            return [None] * self.num_envs
+        return [
+            {
+                key: value[idx] if isinstance(value, (list, tuple)) else value
+                for key, value in options.items()
+            }
+            for idx in range(self.num_envs)
+        ]
+
+    def batch_observations(
+        self, observations: list[dict[str, Observation]]
+    ) -> dict[str, tuple[str, ...] | npt.NDArray[np.uint8]]:
+        batched: dict[str, tuple[str, ...] | npt.NDArray[np.uint8]] = {}
+        for key in observations[0]:
+            values = [observation[key] for observation in observations]
+            if key == "image":
+                batched[key] = np.stack(values)
+            else:
+                batched[key] = tuple(values)  # type: ignore[arg-type]
+        return batched
+
+    def batch_infos(
+        self, infos: list[dict[str, Any]]
+    ) -> dict[str, npt.NDArray[np.object_]]:
+        batched: dict[str, npt.NDArray[np.object_]] = {}
+        for idx, info in enumerate(infos):
+            for key, value in info.items():
+                if key not in batched:
+                    batched[key] = np.full(
+                        self.num_envs, fill_value=None, dtype=object
+                    )
+                batched[key][idx] = value
+        return batched
+
+    async def areset(
+        self,
+        *,
+        seed: int | list[int] | None = None,
+        options: dict[str, Any] | None = None,
+    ) -> tuple[dict[str, Any], dict[str, Any]]:
+        seeds: list[int | None] = (
+            list(seed) if isinstance(seed, list) else [seed] * self.num_envs
+        )
+        results = await asyncio.gather(
+            *[
+                env.areset(seed=env_seed, options=env_options)
+                for env, env_seed, env_options in zip(
+                    self.envs, seeds, self.split_options(options)
+                )
+            ]
+        )
+        observations, infos = zip(*results)
+        return (
+            self.batch_observations(list(observations)),
+            self.batch_infos(list(infos)),
+        )
+
+    def reset(
+        self,
+        *,
+        seed: int | list[int] | None = None,
+        options: dict[str, Any] | None = None,
+    ) -> tuple[dict[str, Any], dict[str, Any]]:
+        return self.run(self.areset(seed=seed, options=options))
+
+    async def astep(
+        self, actions: Sequence[Action] | Mapping[str, Sequence[Any]]
+    ) -> tuple[
+        dict[str, Any],
+        npt.NDArray[np.float64],
+        npt.NDArray[np.bool_[Any]],
+        npt.NDArray[np.bool_[Any]],
+        dict[str, Any],
+    ]:
+        results = await asyncio.gather(
+            *[
+                env.astep(action)
+                for env, action in zip(self.envs, self.split_actions(actions))
+            ]
+        )
+        observations, rewards, terminated, truncated, infos = zip(*results)
+        return (
+            self.batch_observations(list(observations)),
+            np.array(rewards, dtype=np.float64),
+            np.array(terminated, dtype=np.bool_),
+            np.array(truncated, dtype=np.bool_),
+            self.batch_infos(list(infos)),
+        )
+
+    def step(
+        self, actions: Sequence[Action] | Mapping[str, Sequence[Any]]
+    ) -> tuple[
+        dict[str, Any],
+        npt.NDArray[np.float64],
+        npt.NDArray[np.bool_[Any]],
+        npt.NDArray[np.bool_[Any]],
+        dict[str, Any],
+    ]:
+        return self.run(self.astep(actions))
+
+    def close_extras(self, **kwargs: Any) -> None:
+        async def _close() -> None:
+            await asyncio.gather(*[env.aclose() for env in self.envs])
+            await self.context_manager.__aexit__()
+
+        self.run(_close())
+        self.loop.close()
@@ -0,0 +1,167 @@
+"""Disk cache of the LLM responses"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+
+from llms import lm_config
+
+# the gen_config entries that do not change the response
+NON_GENERATION_KEYS = (
+    "cache_dir",
+    "cache_max_size",
+    "cache_sampled",
+    "max_retry",
+    "action_chunk_size",
+    "max_obs_length",
+    "obs_compression",
+)
+
+
+class LLMCache:
+    """Cache the LLM responses on disk, keyed by the hash of the config and
+    the prompt
+
+    The same prompt can be sent many times in a run, e.g., when the response
+    failed to parse. With a temperature above 0, each key keeps the list of
+    its sampled responses and the n-th call of a run gets the n-th cached
+    response, so a replay returns the responses of the first run in the
+    same order and calls the API only past them. When the files take more
+    than `max_size` bytes, the least recently used ones are deleted.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # how many times each key was requested in this run
+        self.occurrences: dict[str, int] = defaultdict(int)
+        self.size = sum(f.stat().st_size for f in self.files())
+
+    def files(self) -> list[Path]:
+        return list(self.cache_dir.glob("*/*.json"))
+
+    @staticmethod
+    def get_key(lm_config: lm_config.LMConfig, prompt: Any) -> str:
+        gen_config = {
+            k: v
+            for k, v in lm_config.gen_config.items()
+            if k not in NON_GENERATION_KEYS
+        }
+        content = json.dumps(
+            {
+                "provider": lm_config.provider,
+                "model": lm_config.model,
+                "mode": lm_config.mode,
+                "gen_config": gen_config,
+                "prompt": prompt,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def next_key(
+        self, lm_config: lm_config.LMConfig, prompt: Any
+    ) -> tuple[str, int]:
+        """The key of the prompt and the index of this call among the calls
+        with the same key"""
+        key = self.get_key(lm_config, prompt)
+        if lm_config.gen_config.get("temperature", 0) == 0:
+            # the response does not change, a single one is kept
+            return key, 0
+        with self.lock:
+            index = self.occurrences[key]
+            self.occurrences[key] += 1
+        return key, index
+
+    def read(self, key: str) -> list[str]:
+        try:
+            with open(self.get_path(key), "r") as f:
+                return json.load(f)["responses"]  # type: ignore[no-any-return]
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def get(self, key: str, index: int) -> str | None:
+        responses = self.read(key)
+        if index >= len(responses):
+            return None
+        try:
+            # mark as recently used
+            os.utime(self.get_path(key))
+        except FileNotFoundError:
+            pass
+        return responses[index]
+
+    def put(self, key: str, index: int, response: str) -> None:
+        path = self.get_path(key)
+        path.parent.mkdir(exist_ok=True)
+        with self.lock:
+            responses = self.read(key)
+            if index != len(responses):
+                # written by another call in the meantime
+                return
+            responses.append(response)
+            old_size = path.stat().st_size if path.exists() else 0
+            # atomic, the cache can be shared by many processes
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"responses": responses}, f)
+            os.replace(tmp_path, path)
+            self.size += path.stat().st_size - old_size
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used files until the cache is back
+        under 90% of its size limit"""
+        entries = []
+        for file in self.files():
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, file in entries:
+            if self.size <= 0.9 * self.max_size:
+                break
+            try:
+                file.unlink()
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+
+llm_caches: dict[str, LLMCache] = {}
+llm_caches_lock = threading.Lock()
+
+
+def get_llm_cache(lm_config: lm_config.LMConfig) -> LLMCache | None:
+    """The cache of the config, None if the config is not cached
+
+    The sampled responses (temperature > 0) are only cached when
+    `cache_sampled` is set, to replay a run rather than sample again.
+    """
+    gen_config = lm_config.gen_config
+    cache_dir = gen_config.get("cache_dir")
+    if not cache_dir:
+        return None
+    if gen_config.get("temperature", 0) > 0 and not gen_config.get(
+        "cache_sampled", False
+    ):
+        return None
+    with llm_caches_lock:
+        if cache_dir not in llm_caches:
+            llm_caches[cache_dir] = LLMCache(
+                cache_dir, gen_config.get("cache_max_size", 1 << 30)
+            )
+        return llm_caches[cache_dir]
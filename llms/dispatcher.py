@@ -0,0 +1,146 @@
+"""Share the LLM rate limit of many concurrent trajectories"""
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, TypeVar
+
+import aiolimiter
+import openai
+
+from llms import lm_config
+from llms.cache import get_llm_cache
+from llms.providers.hf_utils import generate_from_huggingface_completion
+from llms.providers.openai_utils import (
+    _throttled_openai_chat_completion_acreate,
+    _throttled_openai_completion_acreate,
+)
+from llms.utils import APIInput
+
+T = TypeVar("T")
+
+
+class LLMDispatcher:
+    """Share a rate limit among the LLM calls of concurrent trajectories
+
+    The trajectories run in their own threads and block on `call`, the
+    requests run on an event loop in a background thread. The providers
+    take one prompt per request, so each call is its own request: the
+    dispatcher does not batch them, it caps how many run at once to
+    `max_concurrency` and makes the OpenAI requests of all the trajectories
+    share one `aiolimiter` rate limit, instead of each thread retrying on
+    its own rate limit errors. The HuggingFace requests run in a thread
+    pool as their client is synchronous.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        requests_per_minute: int = 300,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, daemon=True
+        )
+        self.thread.start()
+        self.limiter = aiolimiter.AsyncLimiter(requests_per_minute)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """Run a coroutine on the event loop of the dispatcher"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def submit(
+        self, lm_config: lm_config.LMConfig, prompt: APIInput
+    ) -> Future[str]:
+        return asyncio.run_coroutine_threadsafe(
+            self.dispatch(lm_config, prompt), self.loop
+        )
+
+    def call(self, lm_config: lm_config.LMConfig, prompt: APIInput) -> str:
+        """Blocking call with the same interface as `call_llm`"""
+        return self.submit(lm_config, prompt).result()
+
+    async def dispatch(
+        self, lm_config: lm_config.LMConfig, prompt: APIInput
+    ) -> str:
+        async with self.semaphore:
+            return await self.cached_generate(lm_config, prompt)
+
+    async def cached_generate(
+        self, lm_config: lm_config.LMConfig, prompt: APIInput
+    ) -> str:
+        """`generate` behind the response cache of `call_llm`"""
+        cache = get_llm_cache(lm_config)
+        if cache is None:
+            return await self.generate(lm_config, prompt)
+
+        key, index = cache.next_key(lm_config, prompt)
+        response = cache.get(key, index)
+        if response is None:
+            response = await self.generate(lm_config, prompt)
+            if response:
+                cache.put(key, index, response)
+        return response
+
+    async def generate(
+        self, lm_config: lm_config.LMConfig, prompt: APIInput
+    ) -> str:
+        if lm_config.provider == "openai":
+            if "OPENAI_API_KEY" not in os.environ:
+                raise ValueError(
+                    "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+                )
+            openai.api_key = os.environ["OPENAI_API_KEY"]
+            openai.organization = os.environ.get("OPENAI_ORGANIZATION", "")
+            if lm_config.mode == "chat":
+                assert isinstance(prompt, list)
+                response = await _throttled_openai_chat_completion_acreate(
+                    model=lm_config.model,
+                    messages=prompt,
+                    temperature=lm_config.gen_config["temperature"],
+                    max_tokens=lm_config.gen_config["max_tokens"],
+                    top_p=lm_config.gen_config["top_p"],
+                    limiter=self.limiter,
+                )
+                return response["choices"][0]["message"]["content"]  # type: ignore[no-any-return]
+            elif lm_config.mode == "completion":
+                assert isinstance(prompt, str)
+                response = await _throttled_openai_completion_acreate(
+                    engine=lm_config.model,
+                    prompt=prompt,
+                    temperature=lm_config.gen_config["temperature"],
+                    max_tokens=lm_config.gen_config["max_tokens"],
+                    top_p=lm_config.gen_config["top_p"],
+                    limiter=self.limiter,
+                    stop_token=lm_config.gen_config["stop_token"],
+                )
+                return response["choices"][0]["text"]  # type: ignore[no-any-return]
+            else:
+                raise ValueError(
+                    f"OpenAI models do not support mode {lm_config.mode}"
+                )
+        elif lm_config.provider == "huggingface":
+            assert isinstance(prompt, str)
+            return await self.loop.run_in_executor(
+                None,
+                lambda: generate_from_huggingface_completion(
+                    prompt=prompt,
+                    model_endpoint=lm_config.gen_config["model_endpoint"],
+                    temperature=lm_config.gen_config["temperature"],
+                    top_p=lm_config.gen_config["top_p"],
+                    stop_sequences=lm_config.gen_config["stop_sequences"],
+                    max_new_tokens=lm_config.gen_config["max_new_tokens"],
+                ),
+            )
+        else:
+            raise NotImplementedError(
+                f"Provider {lm_config.provider} not implemented"
+            )
+
+    def close(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
@@ -41,7 +41,12 @@ def construct_llm_config(args: argparse.Namespace) -> LMConfig:
         llm_config.gen_config["max_tokens"] = args.max_tokens
         llm_config.gen_config["stop_token"] = args.stop_token
         llm_config.gen_config["max_obs_length"] = args.max_obs_length
+        llm_config.gen_config["obs_compression"] = args.obs_compression
         llm_config.gen_config["max_retry"] = args.max_retry
+        llm_config.gen_config["action_chunk_size"] = args.action_chunk_size
+        llm_config.gen_config["cache_dir"] = args.llm_cache_dir
+        llm_config.gen_config["cache_max_size"] = args.llm_cache_max_size
+        llm_config.gen_config["cache_sampled"] = args.llm_cache_sampled
     elif args.provider == "huggingface":
         llm_config.gen_config["temperature"] = args.temperature
         llm_config.gen_config["top_p"] = args.top_p
@@ -50,8 +55,13 @@ def construct_llm_config(args: argparse.Namespace) -> LMConfig:
             [args.stop_token] if args.stop_token else None
         )
         llm_config.gen_config["max_obs_length"] = args.max_obs_length
+        llm_config.gen_config["obs_compression"] = args.obs_compression
         llm_config.gen_config["model_endpoint"] = args.model_endpoint
         llm_config.gen_config["max_retry"] = args.max_retry
+        llm_config.gen_config["action_chunk_size"] = args.action_chunk_size
+        llm_config.gen_config["cache_dir"] = args.llm_cache_dir
+        llm_config.gen_config["cache_max_size"] = args.llm_cache_max_size
+        llm_config.gen_config["cache_sampled"] = args.llm_cache_sampled
     else:
         raise NotImplementedError(f"provider {args.provider} not implemented")
     return llm_config
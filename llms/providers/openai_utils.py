@@ -64,6 +64,7 @@ async def _throttled_openai_completion_acreate(
     max_tokens: int,
     top_p: float,
     limiter: aiolimiter.AsyncLimiter,
+    stop_token: str | None = None,
 ) -> dict[str, Any]:
     async with limiter:
         for _ in range(3):
@@ -74,6 +75,7 @@ async def _throttled_openai_completion_acreate(
                     temperature=temperature,
                     max_tokens=max_tokens,
                     top_p=top_p,
+                    stop=[stop_token] if stop_token else None,
                 )
             except openai.error.RateLimitError:
                 logging.warning(
@@ -83,7 +85,7 @@ async def _throttled_openai_completion_acreate(
             except openai.error.APIError as e:
                 logging.warning(f"OpenAI API error: {e}")
                 break
-        return {"choices": [{"message": {"content": ""}}]}
+        return {"choices": [{"text": ""}]}
 
 
 async def agenerate_from_openai_completion(
@@ -3,9 +3,18 @@ from typing import Any
 import tiktoken
 from transformers import LlamaTokenizer
 
+# the encodings whose pre-tokenization never merges a newline with the
+# indentation of the next line, their texts can be tokenized line by line
+LINE_SPLITTABLE_ENCODINGS = ("cl100k_base", "o200k_base")
+
 
 class Tokenizer(object):
+    # most lines of an observation repeat across steps, their token counts are
+    # cached up to this many lines
+    max_cached_lines = 100000
+
     def __init__(self, provider: str, model_name: str) -> None:
+        self.line_token_counts: dict[str, int] = {}
         if provider == "openai":
             self.tokenizer = tiktoken.encoding_for_model(model_name)
         elif provider == "huggingface":
@@ -25,3 +34,54 @@ class Tokenizer(object):
 
     def __call__(self, text: str) -> list[int]:
         return self.tokenizer.encode(text)
+
+    @staticmethod
+    def split_lines(text: str) -> list[str]:
+        """Split the text where no token can span the split
+
+        The pre-tokenization of `LINE_SPLITTABLE_ENCODINGS` never merges a
+        newline with what follows, except the whitespace of the next lines
+        when they are blank, so the blank lines stay with the line before
+        them.
+        """
+        chunks: list[str] = []
+        for line in text.split("\n"):
+            if chunks and not line.strip():
+                chunks[-1] += f"\n{line}"
+            elif chunks:
+                chunks[-1] += "\n"
+                chunks.append(line)
+            else:
+                chunks.append(line)
+        return chunks
+
+    def count_line_tokens(self, line: str) -> int:
+        if line not in self.line_token_counts:
+            if len(self.line_token_counts) >= self.max_cached_lines:
+                self.line_token_counts.clear()
+            self.line_token_counts[line] = len(self.encode(line))
+        return self.line_token_counts[line]
+
+    def truncate(self, text: str, max_length: int) -> str:
+        """Same as `decode(encode(text)[:max_length])`, but only the lines
+        within the budget are tokenized and their token counts are cached
+
+        Only `LINE_SPLITTABLE_ENCODINGS` are tokenized line by line, the
+        others tokenize the whole text.
+        """
+        if not (
+            isinstance(self.tokenizer, tiktoken.Encoding)
+            and self.tokenizer.name in LINE_SPLITTABLE_ENCODINGS
+        ):
+            return self.decode(self.encode(text)[:max_length])
+
+        kept: list[str] = []
+        budget = max_length
+        for line in self.split_lines(text):
+            n_tokens = self.count_line_tokens(line)
+            if n_tokens > budget:
+                kept.append(self.decode(self.encode(line)[:budget]))
+                break
+            kept.append(line)
+            budget -= n_tokens
+        return "".join(kept)
@@ -7,6 +7,7 @@ from llms import (
     generate_from_openai_completion,
     lm_config,
 )
+from llms.cache import get_llm_cache
 
 APIInput = str | list[Any] | dict[str, Any]
 
@@ -14,6 +15,24 @@ APIInput = str | list[Any] | dict[str, Any]
 def call_llm(
     lm_config: lm_config.LMConfig,
     prompt: APIInput,
+) -> str:
+    cache = get_llm_cache(lm_config)
+    if cache is None:
+        return generate_response(lm_config, prompt)
+
+    key, index = cache.next_key(lm_config, prompt)
+    response = cache.get(key, index)
+    if response is None:
+        response = generate_response(lm_config, prompt)
+        # an empty response is a failed call, do not replay it
+        if response:
+            cache.put(key, index, response)
+    return response
+
+
+def generate_response(
+    lm_config: lm_config.LMConfig,
+    prompt: APIInput,
 ) -> str:
     response: str
     if lm_config.provider == "openai":
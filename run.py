@@ -1,14 +1,26 @@
 """Script to run end-to-end evaluation on the benchmark"""
 import argparse
+import atexit
 import glob
 import json
 import logging
+import multiprocessing
 import os
 import random
-import subprocess
 import tempfile
+import threading
 import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    BrokenExecutor,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from pathlib import Path
+from typing import Any
 
 import openai
 
@@ -28,12 +40,24 @@ from browser_env import (
     create_stop_action,
 )
 from browser_env.actions import is_equivalent
-from browser_env.auto_login import get_site_comb_from_filepath
+from browser_env.auto_login import (
+    get_site_comb_from_filepath,
+    get_storage_state,
+)
 from browser_env.helper_functions import (
     RenderHelper,
+    StepPipeline,
+    breaks_action_chunk,
     get_action_description,
 )
+from browser_env.scheduler import (
+    DEFAULT_SITE_CONCURRENCY,
+    SiteScheduler,
+    get_task_sites,
+    parse_site_limit,
+)
 from evaluation_harness import evaluator_router
+from llms.dispatcher import LLMDispatcher
 
 LOG_FOLDER = "log_files"
 Path(LOG_FOLDER).mkdir(parents=True, exist_ok=True)
@@ -87,8 +111,79 @@ def config() -> argparse.Namespace:
     parser.add_argument("--viewport_height", type=int, default=720)
     parser.add_argument("--save_trace_enabled", action="store_true")
     parser.add_argument("--sleep_after_execution", type=float, default=0.0)
+    parser.add_argument(
+        "--settle_strategy",
+        choices=["sleep", "adaptive"],
+        default="sleep",
+        help="Sleep for sleep_after_execution after each action, or wait for network and DOM quiescence capped by it",
+    )
+    parser.add_argument(
+        "--reuse_browser",
+        action="store_true",
+        help="Keep the browser alive across tasks and only create a new context per task",
+    )
+    parser.add_argument(
+        "--incremental_observation",
+        action="store_true",
+        help="Only fetch the updated accessibility tree nodes after each action and report the changes in obs_diff",
+    )
+    parser.add_argument(
+        "--auth_cache_dir",
+        type=str,
+        default="./.auth_cache",
+        help="Folder of the cached login cookies, shared by all the workers",
+    )
+    parser.add_argument(
+        "--auth_ttl",
+        type=float,
+        default=3600,
+        help="Seconds before a cached login cookie is checked again",
+    )
 
     parser.add_argument("--max_steps", type=int, default=30)
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Take the screenshot while the LLM is called and write the render while the action is executed",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of workers, each with its own browser, running the tasks in parallel",
+    )
+    parser.add_argument(
+        "--worker_mode",
+        type=str,
+        default="process",
+        choices=["process", "thread"],
+        help="Run the workers as processes, or as threads sharing the rate limit of their LLM calls",
+    )
+    parser.add_argument(
+        "--llm_max_concurrency",
+        type=int,
+        default=8,
+        help="Most LLM calls of the thread workers running at the same time",
+    )
+    parser.add_argument(
+        "--llm_requests_per_minute",
+        type=int,
+        default=300,
+        help="Rate limit of the LLM calls of all the thread workers",
+    )
+    parser.add_argument(
+        "--max_task_retries",
+        type=int,
+        default=2,
+        help="Number of times a failed task is retried when running with multiple workers",
+    )
+    parser.add_argument(
+        "--site_concurrency",
+        type=parse_site_limit,
+        nargs="*",
+        default=[],
+        help="Per-site limits of concurrent tasks with multiple workers, e.g. gitlab=2 map=4",
+    )
 
     # agent config
     parser.add_argument("--agent_type", type=str, default="prompt")
@@ -125,18 +220,48 @@ def config() -> argparse.Namespace:
         help="max retry times to perform generations when parsing fails",
         default=1,
     )
+    parser.add_argument(
+        "--action_chunk_size",
+        type=int,
+        default=1,
+        help="Most actions the agent can predict in one response, executed back to back until one fails or changes the page",
+    )
     parser.add_argument(
         "--max_obs_length",
         type=int,
         help="when not zero, will truncate the observation to this length before feeding to the model",
         default=1920,
     )
+    parser.add_argument(
+        "--obs_compression",
+        type=str,
+        default="truncate",
+        choices=["truncate", "structure"],
+        help="How to fit the observation in max_obs_length: keep its first tokens, or its most relevant nodes",
+    )
     parser.add_argument(
         "--model_endpoint",
         help="huggingface model endpoint",
         type=str,
         default="",
     )
+    parser.add_argument(
+        "--llm_cache_dir",
+        type=str,
+        default="",
+        help="Folder of the cached LLM responses, replayed by the next runs. Disabled if empty",
+    )
+    parser.add_argument(
+        "--llm_cache_max_size",
+        type=int,
+        default=1 << 30,
+        help="Bytes of cached LLM responses before the least recently used ones are deleted",
+    )
+    parser.add_argument(
+        "--llm_cache_sampled",
+        action="store_true",
+        help="Also cache the responses sampled with a temperature above 0",
+    )
 
     # example config
     parser.add_argument("--test_start_idx", type=int, default=0)
@@ -146,6 +271,8 @@ def config() -> argparse.Namespace:
     parser.add_argument("--result_dir", type=str, default="")
     args = parser.parse_args()
 
+    args.site_concurrency = dict(args.site_concurrency)
+
     # check the whether the action space is compatible with the observation space
     if (
         args.action_set_tag == "id_accessibility_tree"
@@ -214,20 +341,8 @@ def early_stop(
     return False, ""
 
 
-def test(
-    args: argparse.Namespace,
-    agent: Agent | PromptAgent | TeacherForcingAgent,
-    config_file_list: list[str],
-) -> None:
-    scores = []
-    max_steps = args.max_steps
-
-    early_stop_thresholds = {
-        "parsing_failure": args.parsing_failure_th,
-        "repeating_action": args.repeating_action_failure_th,
-    }
-
-    env = ScriptBrowserEnv(
+def build_env(args: argparse.Namespace) -> ScriptBrowserEnv:
+    return ScriptBrowserEnv(
         headless=not args.render,
         slow_mo=args.slow_mo,
         observation_type=args.observation_type,
@@ -238,133 +353,350 @@ def test(
         },
         save_trace_enabled=args.save_trace_enabled,
         sleep_after_execution=args.sleep_after_execution,
+        reuse_browser=args.reuse_browser,
+        settle_strategy=args.settle_strategy,
+        incremental_observation=args.incremental_observation,
     )
 
-    for config_file in config_file_list:
-        try:
-            render_helper = RenderHelper(
-                config_file, args.result_dir, args.action_set_tag
-            )
 
-            # get intent
-            with open(config_file) as f:
-                _c = json.load(f)
-                intent = _c["intent"]
-                task_id = _c["task_id"]
-                # automatically login
-                if _c["storage_state"]:
-                    cookie_file_name = os.path.basename(_c["storage_state"])
-                    comb = get_site_comb_from_filepath(cookie_file_name)
-                    temp_dir = tempfile.mkdtemp()
-                    # subprocess to renew the cookie
-                    subprocess.run(
-                        [
-                            "python",
-                            "browser_env/auto_login.py",
-                            "--auth_folder",
-                            temp_dir,
-                            "--site_list",
-                            *comb,
-                        ]
-                    )
-                    _c["storage_state"] = f"{temp_dir}/{cookie_file_name}"
-                    assert os.path.exists(_c["storage_state"])
-                    # update the config file
-                    config_file = f"{temp_dir}/{os.path.basename(config_file)}"
-                    with open(config_file, "w") as f:
-                        json.dump(_c, f)
-
-            logger.info(f"[Config file]: {config_file}")
-            logger.info(f"[Intent]: {intent}")
-
-            agent.reset(config_file)
-            trajectory: Trajectory = []
-            obs, info = env.reset(options={"config_file": config_file})
-            state_info: StateInfo = {"observation": obs, "info": info}
-            trajectory.append(state_info)
+def run_task(
+    args: argparse.Namespace,
+    agent: Agent | PromptAgent | TeacherForcingAgent,
+    env: ScriptBrowserEnv,
+    config_file: str,
+) -> float | None:
+    """Run the agent on a task, return the score or None on error"""
+    score = None
+    max_steps = args.max_steps
 
-            meta_data = {"action_history": ["None"]}
-            while True:
-                early_stop_flag, stop_info = early_stop(
-                    trajectory, max_steps, early_stop_thresholds
+    early_stop_thresholds = {
+        "parsing_failure": args.parsing_failure_th,
+        "repeating_action": args.repeating_action_failure_th,
+    }
+    pipeline: StepPipeline | None = None
+
+    try:
+        render_helper = RenderHelper(
+            config_file, args.result_dir, args.action_set_tag
+        )
+        if args.pipeline:
+            pipeline = StepPipeline(env, render_helper, args.render_screenshot)
+
+        # get intent
+        with open(config_file) as f:
+            _c = json.load(f)
+            intent = _c["intent"]
+            task_id = _c["task_id"]
+            # automatically login
+            if _c["storage_state"]:
+                cookie_file_name = os.path.basename(_c["storage_state"])
+                comb = get_site_comb_from_filepath(cookie_file_name)
+                # only log in again when the cached cookie is stale
+                _c["storage_state"] = get_storage_state(
+                    comb, cache_folder=args.auth_cache_dir, ttl=args.auth_ttl
                 )
+                assert os.path.exists(_c["storage_state"])
+                # update the config file
+                temp_dir = tempfile.mkdtemp()
+                config_file = f"{temp_dir}/{os.path.basename(config_file)}"
+                with open(config_file, "w") as f:
+                    json.dump(_c, f)
+
+        logger.info(f"[Config file]: {config_file}")
+        logger.info(f"[Intent]: {intent}")
+
+        agent.reset(config_file)
+        trajectory: Trajectory = []
+        obs, info = env.reset(options={"config_file": config_file})
+        state_info: StateInfo = {"observation": obs, "info": info}
+        trajectory.append(state_info)
+
+        meta_data = {"action_history": ["None"]}
+        # the rest of an action chunk, executed without calling the agent
+        pending_actions: list[Action] = []
+        while True:
+            early_stop_flag, stop_info = early_stop(
+                trajectory, max_steps, early_stop_thresholds
+            )
 
-                if early_stop_flag:
-                    action = create_stop_action(f"Early stop: {stop_info}")
-                else:
-                    try:
-                        action = agent.next_action(
+            if early_stop_flag:
+                action = create_stop_action(f"Early stop: {stop_info}")
+            elif pending_actions:
+                action = pending_actions.pop(0)
+            else:
+                try:
+                    if pipeline is not None:
+                        actions = pipeline.predict(
+                            lambda: agent.next_actions(
+                                trajectory, intent, meta_data=meta_data
+                            ),
+                            state_info,
+                        )
+                    else:
+                        actions = agent.next_actions(
                             trajectory, intent, meta_data=meta_data
                         )
-                    except ValueError as e:
-                        # get the error message
-                        action = create_stop_action(f"ERROR: {str(e)}")
-
-                trajectory.append(action)
-
-                action_str = get_action_description(
-                    action,
-                    state_info["info"]["observation_metadata"],
-                    action_set_tag=args.action_set_tag,
-                    prompt_constructor=agent.prompt_constructor
-                    if isinstance(agent, PromptAgent)
-                    else None,
-                )
+                    action, pending_actions = actions[0], actions[1:]
+                except ValueError as e:
+                    # get the error message
+                    action = create_stop_action(f"ERROR: {str(e)}")
+
+            trajectory.append(action)
+
+            action_str = get_action_description(
+                action,
+                state_info["info"]["observation_metadata"],
+                action_set_tag=args.action_set_tag,
+                prompt_constructor=agent.prompt_constructor
+                if isinstance(agent, PromptAgent)
+                else None,
+            )
+            if pipeline is not None:
+                pipeline.render(action, state_info, meta_data)
+            else:
                 render_helper.render(
                     action, state_info, meta_data, args.render_screenshot
                 )
-                meta_data["action_history"].append(action_str)
-
-                if action["action_type"] == ActionTypes.STOP:
-                    break
-
-                obs, _, terminated, _, info = env.step(action)
-                state_info = {"observation": obs, "info": info}
-                trajectory.append(state_info)
-
-                if terminated:
-                    # add a action place holder
-                    trajectory.append(create_stop_action(""))
-                    break
-
-            evaluator = evaluator_router(config_file)
-            score = evaluator(
-                trajectory=trajectory,
-                config_file=config_file,
-                page=env.page,
-                client=env.get_page_client(env.page),
-            )
+            meta_data["action_history"].append(action_str)
 
-            scores.append(score)
+            if action["action_type"] == ActionTypes.STOP:
+                break
 
-            if score == 1:
-                logger.info(f"[Result] (PASS) {config_file}")
-            else:
-                logger.info(f"[Result] (FAIL) {config_file}")
+            prev_url = state_info["info"]["page"].url
+            obs, _, terminated, _, info = env.step(action)
+            state_info = {"observation": obs, "info": info}
+            trajectory.append(state_info)
 
-            if args.save_trace_enabled:
-                env.save_trace(
-                    Path(args.result_dir) / "traces" / f"{task_id}.zip"
-                )
+            if terminated:
+                # add a action place holder
+                trajectory.append(create_stop_action(""))
+                break
 
-        except openai.error.OpenAIError as e:
-            logger.info(f"[OpenAI Error] {repr(e)}")
-        except Exception as e:
-            logger.info(f"[Unhandled Error] {repr(e)}]")
-            import traceback
+            if pending_actions and breaks_action_chunk(action, prev_url, info):
+                pending_actions = []
 
-            # write to error file
-            with open(Path(args.result_dir) / "error.txt", "a") as f:
-                f.write(f"[Config file]: {config_file}\n")
-                f.write(f"[Unhandled Error] {repr(e)}\n")
-                f.write(traceback.format_exc())  # write stack trace to file
+        if pipeline is not None:
+            pipeline.flush()
 
-        render_helper.close()
+        evaluator = evaluator_router(config_file)
+        score = evaluator(
+            trajectory=trajectory,
+            config_file=config_file,
+            page=env.page,
+            client=env.get_page_client(env.page),
+        )
+
+        if score == 1:
+            logger.info(f"[Result] (PASS) {config_file}")
+        else:
+            logger.info(f"[Result] (FAIL) {config_file}")
+
+        if args.save_trace_enabled:
+            env.save_trace(Path(args.result_dir) / "traces" / f"{task_id}.zip")
+
+    except openai.error.OpenAIError as e:
+        logger.info(f"[OpenAI Error] {repr(e)}")
+    except Exception as e:
+        logger.info(f"[Unhandled Error] {repr(e)}]")
+        import traceback
+
+        # write to error file
+        with open(Path(args.result_dir) / "error.txt", "a") as f:
+            f.write(f"[Config file]: {config_file}\n")
+            f.write(f"[Unhandled Error] {repr(e)}\n")
+            f.write(traceback.format_exc())  # write stack trace to file
+
+    if pipeline is not None:
+        pipeline.close()
+    render_helper.close()
+    return score
+
+
+def test(
+    args: argparse.Namespace,
+    agent: Agent | PromptAgent | TeacherForcingAgent,
+    config_file_list: list[str],
+) -> None:
+    scores = []
+    env = build_env(args)
+
+    for config_file in config_file_list:
+        score = run_task(args, agent, env, config_file)
+        if score is not None:
+            scores.append(score)
 
     env.close()
     logger.info(f"Average score: {sum(scores) / len(scores)}")
 
 
+# the agent and the environment of a worker, reused across tasks
+worker_state = threading.local()
+
+
+def init_worker(
+    args: argparse.Namespace, llm_dispatcher: LLMDispatcher | None = None
+) -> None:
+    worker_state.agent = construct_agent(args, llm_dispatcher=llm_dispatcher)
+    worker_state.env = None
+    if args.worker_mode == "process":
+        # each worker logs to its own file, register it for check_error_runs.py
+        with open(os.path.join(args.result_dir, "log_files.txt"), "a+") as f:
+            f.write(f"{LOG_FILE_NAME}\n")
+        worker_state.env = build_env(args)
+        atexit.register(worker_state.env.close)
+
+
+def run_task_in_worker(
+    args: argparse.Namespace, config_file: str
+) -> tuple[float | None, float]:
+    start_time = time.time()
+    if worker_state.env is None:
+        # a thread worker starts its browser with its first task
+        worker_state.env = build_env(args)
+    score = run_task(args, worker_state.agent, worker_state.env, config_file)
+    return score, time.time() - start_time
+
+
+def close_worker(barrier: threading.Barrier) -> None:
+    """Close the environment of a thread worker
+
+    The playwright objects can only be used by the thread that created them.
+    The barrier holds each call until every worker runs one, so each worker
+    closes its own environment.
+    """
+    barrier.wait()
+    if worker_state.env is not None:
+        worker_state.env.close()
+        worker_state.env = None
+
+
+def make_executor(
+    args: argparse.Namespace, llm_dispatcher: LLMDispatcher | None
+) -> Executor:
+    if args.worker_mode == "thread":
+        return ThreadPoolExecutor(
+            max_workers=args.workers,
+            initializer=init_worker,
+            initargs=(args, llm_dispatcher),
+        )
+    return ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(args,),
+    )
+
+
+def test_parallel(
+    args: argparse.Namespace, config_file_list: list[str]
+) -> None:
+    """Run the tasks in a pool of `args.workers` workers
+
+    Each worker keeps its own agent and browser and gets the next task once
+    it is done with the previous one. With `args.worker_mode` "thread", the
+    workers are threads of this process whose agents send their LLM calls
+    to one shared `LLMDispatcher`, which rate limits them all together.
+    The tasks are scheduled by `SiteScheduler` so that no backend gets more
+    concurrent tasks than its limit. The failed tasks are retried on their
+    own, up to `args.max_task_retries` times. The scores of all the workers
+    are merged in `results.json` in the result dir.
+    """
+    durations_file = Path(args.result_dir) / "task_durations.json"
+    durations: dict[str, float] = {}
+    if durations_file.exists():
+        with open(durations_file) as f:
+            durations = json.load(f)
+    # longest tasks first (unknown ones included) so the workers end together
+    config_file_list = sorted(
+        config_file_list,
+        key=lambda c: durations.get(c, float("inf")),
+        reverse=True,
+    )
+    task_sites = {c: get_task_sites(c) for c in config_file_list}
+    attempts = {config_file: 0 for config_file in config_file_list}
+    scores: dict[str, float] = {}
+
+    scheduler = SiteScheduler(
+        {**DEFAULT_SITE_CONCURRENCY, **args.site_concurrency}
+    )
+    for config_file in config_file_list:
+        scheduler.add(config_file, task_sites[config_file])
+
+    llm_dispatcher = None
+    if args.worker_mode == "thread":
+        llm_dispatcher = LLMDispatcher(
+            max_concurrency=args.llm_max_concurrency,
+            requests_per_minute=args.llm_requests_per_minute,
+        )
+
+    while len(scheduler):
+        # a new pool if a worker crashed
+        with make_executor(args, llm_dispatcher) as executor:
+            futures: dict[Future[tuple[float | None, float]], str] = {}
+            broken = False
+            while len(scheduler) and not broken:
+                # start the tasks the sites can take until all workers are busy
+                while len(futures) < args.workers:
+                    next_config_file = scheduler.next_task()
+                    if next_config_file is None:
+                        break
+                    future = executor.submit(
+                        run_task_in_worker, args, next_config_file
+                    )
+                    futures[future] = next_config_file
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    config_file = futures.pop(future)
+                    scheduler.finish(config_file)
+                    attempts[config_file] += 1
+                    try:
+                        score, duration = future.result()
+                    except Exception as e:
+                        logger.info(f"[Worker Error] {config_file}: {repr(e)}")
+                        broken = isinstance(e, BrokenExecutor)
+                        score = None
+
+                    if score is not None:
+                        scores[config_file] = score
+                        durations[config_file] = duration
+                    elif attempts[config_file] <= args.max_task_retries:
+                        logger.info(f"[Retry] {config_file}")
+                        scheduler.add(config_file, task_sites[config_file])
+                    else:
+                        logger.info(f"[Give up] {config_file}")
+
+            # the other tasks of a crashed pool are run again, not counted
+            for config_file in futures.values():
+                scheduler.finish(config_file)
+                scheduler.add(config_file, task_sites[config_file])
+
+            if args.worker_mode == "thread" and not broken:
+                barrier = threading.Barrier(args.workers)
+                wait(
+                    [
+                        executor.submit(close_worker, barrier)
+                        for _ in range(args.workers)
+                    ]
+                )
+
+    if llm_dispatcher is not None:
+        llm_dispatcher.close()
+
+    with open(durations_file, "w") as f:
+        json.dump(durations, f, indent=4)
+
+    results_file = Path(args.result_dir) / "results.json"
+    if results_file.exists():
+        with open(results_file) as f:
+            scores = {**json.load(f), **scores}
+    with open(results_file, "w") as f:
+        json.dump(scores, f, indent=4)
+
+    if scores:
+        logger.info(f"Average score: {sum(scores.values()) / len(scores)}")
+
+
 def prepare(args: argparse.Namespace) -> None:
     # convert prompt python files to json
     from agent.prompts import to_json
@@ -435,5 +767,8 @@ if __name__ == "__main__":
         args.current_viewport_only = True
         dump_config(args)
 
-        agent = construct_agent(args)
-        test(args, agent, test_file_list)
+        if args.workers > 1:
+            test_parallel(args, test_file_list)
+        else:
+            agent = construct_agent(args)
+            test(args, agent, test_file_list)
@@ -0,0 +1,203 @@
+"""Micro-benchmark of the accessibility tree serializer.
+
+Compare `TextObervationProcessor.parse_accessibility_tree` against the
+previous recursive serializer and check that both produce the same output.
+Recorded trees are JSON lists of nodes returned by
+`TextObervationProcessor.fetch_page_accessibility_tree` (or the raw nodes of
+`Accessibility.getFullAXTree`). Without recorded trees, synthetic product
+listings and nested threads of increasing size are used.
+
+Usage: python -m scripts.benchmark_tree_serializer [--tree_files a.json ...]
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Any, Callable
+
+from browser_env.constants import IGNORED_ACTREE_PROPERTIES
+from browser_env.processors import TextObervationProcessor
+from browser_env.utils import AccessibilityTree
+
+
+def recursive_parse_accessibility_tree(
+    accessibility_tree: AccessibilityTree,
+) -> tuple[str, dict[str, Any]]:
+    """The recursive serializer before the rewrite, used as the baseline"""
+    node_id_to_idx = {}
+    for idx, node in enumerate(accessibility_tree):
+        node_id_to_idx[node["nodeId"]] = idx
+
+    obs_nodes_info = {}
+
+    def dfs(idx: int, obs_node_id: str, depth: int) -> str:
+        tree_str = ""
+        node = accessibility_tree[idx]
+        indent = "\t" * depth
+        valid_node = True
+        try:
+            role = node["role"]["value"]
+            name = node["name"]["value"]
+            node_str = f"[{obs_node_id}] {role} {repr(name)}"
+            properties = []
+            for property in node.get("properties", []):
+                try:
+                    if property["name"] in IGNORED_ACTREE_PROPERTIES:
+                        continue
+                    properties.append(
+                        f'{property["name"]}: {property["value"]["value"]}'
+                    )
+                except KeyError:
+                    pass
+
+            if properties:
+                node_str += " " + " ".join(properties)
+
+            if not node_str.strip():
+                valid_node = False
+
+            if not name.strip():
+                if not properties:
+                    if role in [
+                        "generic",
+                        "img",
+                        "list",
+                        "strong",
+                        "paragraph",
+                        "banner",
+                        "navigation",
+                        "Section",
+                        "LabelText",
+                        "Legend",
+                        "listitem",
+                    ]:
+                        valid_node = False
+                elif role in ["listitem"]:
+                    valid_node = False
+
+            if valid_node:
+                tree_str += f"{indent}{node_str}"
+                obs_nodes_info[obs_node_id] = {
+                    "backend_id": node["backendDOMNodeId"],
+                    "union_bound": node["union_bound"],
+                    "text": node_str,
+                }
+
+        except Exception as e:
+            valid_node = False
+
+        for _, child_node_id in enumerate(node["childIds"]):
+            if child_node_id not in node_id_to_idx:
+                continue
+            child_depth = depth + 1 if valid_node else depth
+            child_str = dfs(
+                node_id_to_idx[child_node_id], child_node_id, child_depth
+            )
+            if child_str.strip():
+                if tree_str.strip():
+                    tree_str += "\n"
+                tree_str += child_str
+
+        return tree_str
+
+    tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
+    return tree_str, obs_nodes_info
+
+
+def make_listing_tree(
+    num_items: int, depth: int, wrapper_role: str = "generic"
+) -> AccessibilityTree:
+    """A listing where each item is wrapped in `depth` nested nodes"""
+    tree: list[dict[str, Any]] = []
+
+    def add_node(role: str, name: str, parent_id: str) -> str:
+        node_id = str(len(tree) + 1)
+        tree.append(
+            {
+                "nodeId": node_id,
+                "role": {"value": role},
+                "name": {"value": name},
+                "properties": [],
+                "childIds": [],
+                "parentId": parent_id,
+                "backendDOMNodeId": len(tree) + 1,
+                "union_bound": [0.0, 0.0, 10.0, 10.0],
+            }
+        )
+        if parent_id:
+            tree[int(parent_id) - 1]["childIds"].append(node_id)
+        return node_id
+
+    root_id = add_node("RootWebArea", "Products", "")
+    list_id = add_node("list", "", root_id)
+    for item_idx in range(num_items):
+        parent_id = add_node("listitem", "", list_id)
+        for _ in range(depth):
+            parent_id = add_node(wrapper_role, "", parent_id)
+        add_node("link", f"Product {item_idx}", parent_id)
+        add_node("StaticText", f"${item_idx}.99", parent_id)
+        add_node("button", "Add to Cart", parent_id)
+    return tree  # type: ignore[return-value]
+
+
+def bench(
+    func: Callable[[AccessibilityTree], tuple[str, dict[str, Any]]],
+    tree: AccessibilityTree,
+    repeat: int,
+) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(tree)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(tree_files: list[str], repeat: int) -> None:
+    trees: list[tuple[str, AccessibilityTree]] = []
+    for tree_file in tree_files:
+        with open(tree_file, "r") as f:
+            tree = json.load(f)
+        for node in tree:
+            node.setdefault("union_bound", None)
+        trees.append((tree_file, tree))
+    if not trees:
+        for num_items in [100, 1000, 5000]:
+            trees.append(
+                (
+                    f"listing_{num_items}_items",
+                    make_listing_tree(num_items, depth=20),
+                )
+            )
+        # nested comment threads, every level is serialized
+        for depth in [100, 500]:
+            trees.append(
+                (
+                    f"thread_{depth}_levels",
+                    make_listing_tree(200, depth=depth, wrapper_role="group"),
+                )
+            )
+
+    # the baseline is recursive
+    sys.setrecursionlimit(100000)
+    for tree_name, tree in trees:
+        expected = recursive_parse_accessibility_tree(tree)
+        output = TextObervationProcessor.parse_accessibility_tree(tree)
+        assert output == expected, f"Different output on {tree_name}"
+
+        baseline = bench(recursive_parse_accessibility_tree, tree, repeat)
+        current = bench(
+            TextObervationProcessor.parse_accessibility_tree, tree, repeat
+        )
+        print(
+            f"{tree_name} ({len(tree)} nodes): recursive {baseline * 1000:.1f}ms, "
+            f"iterative {current * 1000:.1f}ms, speedup {baseline / current:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree_files", nargs="+", default=[])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.tree_files, args.repeat)
@@ -1,9 +1,13 @@
 from typing import AsyncGenerator, Generator
+from unittest import mock
 
 import pytest
 import pytest_asyncio
+import tiktoken
+from tiktoken_ext import openai_public
 
 from browser_env import AsyncScriptBrowserEnv, ScriptBrowserEnv
+from llms.tokenizers import Tokenizer
 
 HEADLESS = True
 SLOW_MO = 0
@@ -70,3 +74,35 @@ async def async_script_browser_env() -> AsyncGenerator[
     env = AsyncScriptBrowserEnv(headless=HEADLESS, slow_mo=SLOW_MO)
     yield env
     await env.aclose()
+
+
+@pytest.fixture(scope="function")
+def cl100k_tokenizer(monkeypatch: pytest.MonkeyPatch) -> Tokenizer:
+    """A Tokenizer with the cl100k_base pre-tokenization and a toy
+    vocabulary, the real one cannot be downloaded offline"""
+    tokens = [bytes([idx]) for idx in range(256)]
+    for merge in [
+        b"\n\n",
+        b"\t\t",
+        b"  ",
+        b"    ",
+        b".\n",
+        b" \n",
+        b"\n\t",
+        b"in",
+        b"th",
+        b"the",
+        b"ing",
+        b"er",
+        b"on",
+    ]:
+        tokens.append(merge)
+    mergeable_ranks = {token: rank for rank, token in enumerate(tokens)}
+    with mock.patch.object(
+        openai_public, "load_tiktoken_bpe", return_value=mergeable_ranks
+    ):
+        encoding = tiktoken.Encoding(**openai_public.cl100k_base())
+    monkeypatch.setattr(
+        tiktoken, "encoding_for_model", lambda model_name: encoding
+    )
+    return Tokenizer("openai", "gpt-4")
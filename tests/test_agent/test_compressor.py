@@ -0,0 +1,80 @@
+from typing import Any
+
+from agent.prompts.compressor import ObservationCompressor
+from llms.tokenizers import Tokenizer
+
+OBS_LINES = [
+    "Tab 0 (current): One Stop Market",
+    "",
+    "[1] RootWebArea 'One Stop Market' focused: True",
+    "\t[2] banner ''",
+    "\t\t[3] StaticText 'Welcome to One Stop Market'",
+    "\t[4] main ''",
+    *[
+        f"\t\t[{node_id}] StaticText 'Lorem ipsum dolor sit amet {node_id}'"
+        for node_id in range(5, 25)
+    ],
+    "\t\t[25] list ''",
+    "\t\t\t[26] listitem ''",
+    "\t\t\t\t[27] StaticText 'Wireless headphones, noise cancelling'",
+    "\t\t[28] button 'Add to Cart'",
+]
+OBS = "\n".join(OBS_LINES)
+# one line every 50 pixels
+OBS_NODES_INFO: dict[str, Any] = {
+    str(node_id): {"union_bound": [0.0, 50.0 * node_id, 100.0, 20.0]}
+    for node_id in range(1, 29)
+}
+INTENT = "Buy the cheapest wireless headphones"
+
+
+def get_kept_lines(
+    compressor: ObservationCompressor, max_length: int
+) -> list[str]:
+    compressed = compressor.compress(OBS, max_length, INTENT, OBS_NODES_INFO)
+    return compressed.split("\n")
+
+
+def test_compress_within_budget(cl100k_tokenizer: Tokenizer) -> None:
+    compressor = ObservationCompressor(cl100k_tokenizer)
+    for max_length in range(40, len(cl100k_tokenizer.encode(OBS)), 20):
+        compressed = compressor.compress(
+            OBS, max_length, INTENT, OBS_NODES_INFO
+        )
+        assert len(cl100k_tokenizer.encode(compressed)) <= max_length
+
+
+def test_compress_keeps_structure(cl100k_tokenizer: Tokenizer) -> None:
+    compressor = ObservationCompressor(cl100k_tokenizer)
+    kept_lines = get_kept_lines(compressor, 300)
+    assert len(kept_lines) < len(OBS_LINES)
+    # the tab titles and the blank line before the tree
+    assert kept_lines[:2] == OBS_LINES[:2]
+    # the kept lines are unchanged and in the order of the page
+    idxs = [OBS_LINES.index(line) for line in kept_lines]
+    assert idxs == sorted(idxs)
+    # every kept node comes with its ancestors
+    lines = compressor.parse_lines(OBS)
+    for idx in idxs:
+        parent = lines[idx].parent
+        assert parent is None or parent in idxs
+
+
+def test_compress_prefers_intent_and_interactive(
+    cl100k_tokenizer: Tokenizer,
+) -> None:
+    compressor = ObservationCompressor(cl100k_tokenizer)
+    kept_lines = get_kept_lines(compressor, 300)
+    # far down the page, but matches the intent
+    assert OBS_LINES[-2] in kept_lines
+    # far down the page, but the agent can click it
+    assert OBS_LINES[-1] in kept_lines
+    # the filler text does not fit
+    assert not any("Lorem ipsum" in line for line in kept_lines)
+
+
+def test_compress_fast_path(cl100k_tokenizer: Tokenizer) -> None:
+    compressor = ObservationCompressor(cl100k_tokenizer)
+    # the sum of the line token counts is an upper bound of the tokens
+    max_length = 2 * len(cl100k_tokenizer.encode(OBS))
+    assert compressor.compress(OBS, max_length, INTENT, OBS_NODES_INFO) is OBS
@@ -0,0 +1,187 @@
+import json
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+from agent import PromptAgent
+from agent.prompts import DirectPromptConstructor
+from agent.prompts.raw import p_direct_id_actree_2s
+from browser_env import ActionTypes, StateInfo, Trajectory
+from browser_env.actions import (
+    ActionParsingError,
+    create_goto_url_action,
+    create_id_based_action,
+)
+from browser_env.helper_functions import breaks_action_chunk
+from browser_env.utils import DetachedPage
+from llms import lm_config
+from llms.tokenizers import Tokenizer
+
+URL = "http://localhost:7770/"
+
+
+@pytest.fixture(scope="function")
+def instruction_path(tmp_path: Path) -> Path:
+    path = tmp_path / "p_direct_id_actree_2s.json"
+    with open(path, "w") as f:
+        json.dump(p_direct_id_actree_2s.prompt, f)
+    return path
+
+
+def make_agent(
+    instruction_path: Path,
+    tokenizer: Tokenizer,
+    action_chunk_size: int,
+) -> PromptAgent:
+    llm_config = lm_config.LMConfig(
+        provider="openai",
+        model="gpt-3.5-turbo",
+        mode="chat",
+        gen_config={
+            "temperature": 0.0,
+            "top_p": 0.9,
+            "max_tokens": 384,
+            "max_retry": 2,
+            "max_obs_length": 0,
+            "action_chunk_size": action_chunk_size,
+        },
+    )
+    prompt_constructor = DirectPromptConstructor(
+        instruction_path, lm_config=llm_config, tokenizer=tokenizer
+    )
+    return PromptAgent(
+        action_set_tag="id_accessibility_tree",
+        lm_config=llm_config,
+        prompt_constructor=prompt_constructor,
+    )
+
+
+def predict(
+    agent: PromptAgent,
+    responses: list[str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> tuple[list[dict[str, Any]], int]:
+    """The actions predicted from the responses and the number of LLM calls"""
+    calls: Iterator[str] = iter(responses)
+    n_calls = 0
+
+    def call_llm(lm_config: lm_config.LMConfig, prompt: Any) -> str:
+        nonlocal n_calls
+        n_calls += 1
+        return next(calls)
+
+    monkeypatch.setattr("agent.agent.call_llm", call_llm)
+    state_info: StateInfo = {
+        "observation": {"text": "[1] RootWebArea 'Shop'\n\t[2] link 'Home'"},
+        "info": {"page": DetachedPage(URL, ""), "observation_metadata": {}},
+    }
+    trajectory: Trajectory = [state_info]
+    actions = agent.next_actions(
+        trajectory, "Go home", {"action_history": ["None"]}
+    )
+    return [dict(action) for action in actions], n_calls
+
+
+def test_next_actions_chunk_size(
+    instruction_path: Path,
+    cl100k_tokenizer: Tokenizer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    response = (
+        "First ```click [2]```, then ```type [3] [shoes] [1]```,"
+        " then ```scroll [down]```."
+    )
+    agent = make_agent(instruction_path, cl100k_tokenizer, 2)
+    actions, n_calls = predict(agent, [response], monkeypatch)
+    assert n_calls == 1
+    assert [action["action_type"] for action in actions] == [
+        ActionTypes.CLICK,
+        ActionTypes.TYPE,
+    ]
+    assert all(action["raw_prediction"] == response for action in actions)
+
+    # a single action out of the chunk mode
+    agent = make_agent(instruction_path, cl100k_tokenizer, 1)
+    actions, _ = predict(agent, [response], monkeypatch)
+    assert [action["action_type"] for action in actions] == [ActionTypes.CLICK]
+
+
+def test_next_actions_drops_unparsable(
+    instruction_path: Path,
+    cl100k_tokenizer: Tokenizer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    agent = make_agent(instruction_path, cl100k_tokenizer, 3)
+    actions, n_calls = predict(
+        agent,
+        ["```click [2]``` ```fly [3]``` ```click [4]```"],
+        monkeypatch,
+    )
+    assert n_calls == 1
+    assert [action["action_type"] for action in actions] == [ActionTypes.CLICK]
+    assert actions[0]["element_id"] == "2"
+
+
+def test_next_actions_retry(
+    instruction_path: Path,
+    cl100k_tokenizer: Tokenizer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    agent = make_agent(instruction_path, cl100k_tokenizer, 3)
+    actions, n_calls = predict(
+        agent,
+        ["```fly [2]``` ```click [3]```", "```click [2]```"],
+        monkeypatch,
+    )
+    assert n_calls == 2
+    assert [action["action_type"] for action in actions] == [ActionTypes.CLICK]
+
+    # out of retries
+    actions, n_calls = predict(
+        agent, ["```fly [2]```", "no action"], monkeypatch
+    )
+    assert n_calls == 2
+    assert [action["action_type"] for action in actions] == [ActionTypes.NONE]
+    assert actions[0]["raw_prediction"] == "no action"
+
+
+def test_extract_actions(
+    instruction_path: Path, cl100k_tokenizer: Tokenizer
+) -> None:
+    agent = make_agent(instruction_path, cl100k_tokenizer, 2)
+    prompt_constructor = agent.prompt_constructor
+    response = "```click [2]``` ```goto [http://localhost:7770]``` ```stop```"
+    assert prompt_constructor.extract_actions(response) == ["click [2]"]
+    assert prompt_constructor.extract_actions(response, 2) == [
+        "click [2]",
+        "goto [http://localhost:7770]",
+    ]
+    with pytest.raises(ActionParsingError):
+        prompt_constructor.extract_actions("click [2]", 2)
+
+
+def test_get_intro(
+    instruction_path: Path, cl100k_tokenizer: Tokenizer
+) -> None:
+    rule = "You should only issue one action at a time"
+    agent = make_agent(instruction_path, cl100k_tokenizer, 1)
+    assert rule in agent.prompt_constructor.get_intro()
+
+    agent = make_agent(instruction_path, cl100k_tokenizer, 3)
+    intro = agent.prompt_constructor.get_intro()
+    # the one action rule is replaced, not contradicted
+    assert rule not in intro
+    assert "2. You can issue up to 3 actions at a time" in intro
+
+
+def test_breaks_action_chunk() -> None:
+    click = create_id_based_action("click [2]")
+    info: dict[str, Any] = {"fail_error": "", "page": DetachedPage(URL, "")}
+    assert not breaks_action_chunk(click, URL, info)
+    # the action failed
+    assert breaks_action_chunk(click, URL, {**info, "fail_error": "timeout"})
+    # the action loaded another page
+    assert breaks_action_chunk(click, f"{URL}cart", info)
+    # the action changes the page even when the url stays the same
+    assert breaks_action_chunk(create_goto_url_action(URL), URL, info)
@@ -85,3 +85,20 @@ def test_action2create_function() -> None:
         action = create_random_action()
         create_function = action2create_function(action)
         assert is_equivalent(action, eval(create_function))
+
+
+def test_get_in_viewport_mask() -> None:
+    from browser_env.actions import get_in_viewport_mask
+
+    boxes = np.array(
+        [
+            [10, 10, 100, 100],  # fully inside
+            [1200, 10, 200, 100],  # 40% inside
+            [1250, 10, 200, 100],  # 15% inside
+            [10, 800, 100, 100],  # below the viewport
+            [0, 0, 0, 0],  # no box, e.g. display: none
+            [np.nan, np.nan, np.nan, np.nan],
+        ]
+    )
+    mask = get_in_viewport_mask(boxes, {"width": 1280, "height": 720})
+    assert mask.tolist() == [True, True, False, False, False, False]
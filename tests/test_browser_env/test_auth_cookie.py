@@ -1,7 +1,11 @@
 import asyncio
 import json
+from pathlib import Path
+
+import pytest
 
 from browser_env import *
+from browser_env import auto_login
 
 auth_json = {
     "cookies": [
@@ -65,3 +69,26 @@ def test_async_auth_cookie() -> None:
         await env.aclose()
 
     asyncio.run(_test())
+
+
+def test_is_expired_browser_with_open_env(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # the env of the previous task still runs the sync playwright api
+    env = ScriptBrowserEnv()
+    env.reset()
+    json.dump(auth_json, open("/tmp/auth.json", "w"))
+    # force the browser fallback
+    monkeypatch.setattr(auto_login, "is_expired_http", lambda *args: None)
+    assert not auto_login.is_expired(
+        Path("/tmp/auth.json"),
+        "https://www.saucedemo.com/inventory.html",
+        keyword="Products",
+    )
+    json.dump({"cookies": [], "origins": []}, open("/tmp/no_auth.json", "w"))
+    assert auto_login.is_expired(
+        Path("/tmp/no_auth.json"),
+        "https://www.saucedemo.com/inventory.html",
+        keyword="Products",
+    )
+    env.close()
@@ -0,0 +1,98 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+import requests
+
+from browser_env.auto_login import (
+    has_browser_cookies,
+    is_expired_http,
+    session_to_storage_state,
+)
+
+
+class AccountHandler(BaseHTTPRequestHandler):
+    """An account page behind a session cookie"""
+
+    def do_GET(self) -> None:
+        if self.path == "/account" and "sid=1" in self.headers.get(
+            "Cookie", ""
+        ):
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"Welcome back")
+        elif self.path == "/account":
+            self.send_response(302)
+            self.send_header("Location", "/login")
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("Set-Cookie", "sid=1; Path=/")
+            self.end_headers()
+            self.wfile.write(b"Sign in")
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+@pytest.fixture(scope="module")
+def port() -> Iterator[int]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), AccountHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_port
+    server.shutdown()
+
+
+def write_state(path: Path, domain: str | None) -> Path:
+    cookies = []
+    if domain is not None:
+        cookies.append(
+            {
+                "name": "sid",
+                "value": "1",
+                "domain": domain,
+                "path": "/",
+                "expires": -1,
+                "httpOnly": False,
+                "secure": False,
+                "sameSite": "Lax",
+            }
+        )
+    with open(path, "w") as f:
+        json.dump({"cookies": cookies, "origins": []}, f)
+    return path
+
+
+@pytest.mark.parametrize("host", ["localhost", "127.0.0.1"])
+def test_is_expired_http_browser_state(
+    host: str, port: int, tmp_path: Path
+) -> None:
+    url = f"http://{host}:{port}/account"
+    # the domains of the cookies written by the browser
+    for domain in [host, f".{host}"]:
+        state = write_state(tmp_path / "state.json", domain)
+        assert is_expired_http(state, url, "Welcome") is False
+        assert is_expired_http(state, url, "") is False
+    state = write_state(tmp_path / "state.json", None)
+    assert is_expired_http(state, url, "Welcome") is True
+
+
+@pytest.mark.parametrize("host", ["localhost", "127.0.0.1"])
+def test_session_to_storage_state(
+    host: str, port: int, tmp_path: Path
+) -> None:
+    url = f"http://{host}:{port}/account"
+    session = requests.Session()
+    session.get(f"http://{host}:{port}/login")
+    state = session_to_storage_state(session, [url])
+    assert [cookie["domain"] for cookie in state["cookies"]] == [host]
+    assert has_browser_cookies(state, url)
+    assert not has_browser_cookies(state, "http://example.com/account")
+    path = tmp_path / "state.json"
+    with open(path, "w") as f:
+        json.dump(state, f)
+    assert is_expired_http(path, url, "Welcome") is False
@@ -0,0 +1,359 @@
+import asyncio
+import copy
+from collections import defaultdict
+from typing import Any
+
+import pytest
+
+from browser_env import (
+    ScriptBrowserEnv,
+    create_playwright_action,
+    create_scroll_action,
+)
+from browser_env.processors import (
+    TextObervationProcessor,
+    get_observation_diff,
+    remove_nodes_from_tree,
+)
+
+
+def test_batched_bounding_client_rects(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.reset()
+    env.step(
+        create_playwright_action(
+            'page.goto("https://russmaxdesign.github.io/exercise/")'
+        )
+    )
+    env.step(create_scroll_action("down"))
+    processor = env.observation_handler.text_processor
+    client = env.get_page_client(env.page)
+    info = processor.fetch_browser_info(env.page, client)
+
+    accessibility_tree = client.send("Accessibility.getFullAXTree", {})[
+        "nodes"
+    ]
+    backend_node_ids = [
+        str(node["backendDOMNodeId"])
+        for node in accessibility_tree
+        if "backendDOMNodeId" in node
+    ]
+    bounds = processor.get_bounding_client_rects(
+        client, backend_node_ids, info
+    )
+
+    for backend_node_id in backend_node_ids:
+        response = TextObervationProcessor.get_bounding_client_rect(
+            client, backend_node_id
+        )
+        if response.get("result", {}).get("subtype", "") == "error":
+            assert bounds[backend_node_id] is None
+            continue
+        rect = response["result"]["value"]
+        expected = [rect["x"], rect["y"], rect["width"], rect["height"]]
+        assert bounds[backend_node_id] == pytest.approx(expected, abs=1.0)
+
+
+def test_lazy_image_observation(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.reset()
+    obs, *_ = env.step(
+        create_playwright_action('page.goto("http://www.example.com")')
+    )
+    # the screenshot is only taken on demand
+    assert "text" in obs and "image" not in obs
+    assert obs["image"].shape[:2] == (720, 1280)  # type: ignore[union-attr]
+
+    prev_obs, *_ = env.step(create_scroll_action("down"))
+    env.step(create_scroll_action("up"))
+    with pytest.raises(KeyError):
+        prev_obs["image"]
+
+
+def _ax_node(
+    node_id: str, role: str, name: str, child_ids: list[str]
+) -> dict[str, object]:
+    return {
+        "nodeId": node_id,
+        "role": {"value": role},
+        "name": {"value": name},
+        "properties": [],
+        "childIds": child_ids,
+        "backendDOMNodeId": int(node_id),
+        "union_bound": [0.0, 0.0, 10.0, 10.0],
+    }
+
+
+def test_parse_accessibility_tree() -> None:
+    tree = [
+        _ax_node("1", "RootWebArea", "Page", ["2", "5"]),
+        _ax_node("2", "generic", "", ["3", "4"]),
+        _ax_node("3", "link", "Home", []),
+        _ax_node("4", "button", "Search", ["99"]),
+        _ax_node("5", "list", "Results", ["6"]),
+        _ax_node("6", "StaticText", "1 item", []),
+    ]
+    (
+        tree_str,
+        obs_nodes_info,
+    ) = TextObervationProcessor.parse_accessibility_tree(
+        tree  # type: ignore[arg-type]
+    )
+    assert tree_str == (
+        "[1] RootWebArea 'Page'\n"
+        "\t[3] link 'Home'\n"
+        "\t[4] button 'Search'\n"
+        "\t[5] list 'Results'\n"
+        "\t\t[6] StaticText '1 item'"
+    )
+    assert list(obs_nodes_info) == ["1", "3", "4", "5", "6"]
+
+
+def test_parse_accessibility_tree_deep_tree() -> None:
+    depth = 5000
+    tree = [
+        _ax_node(str(i), "group", f"level {i}", [str(i + 1)])
+        for i in range(1, depth + 1)
+    ]
+    tree_str, _ = TextObervationProcessor.parse_accessibility_tree(
+        tree  # type: ignore[arg-type]
+    )
+    lines = tree_str.split("\n")
+    assert len(lines) == depth
+    assert lines[-1] == "\t" * (depth - 1) + f"[{depth}] group 'level {depth}'"
+
+
+def test_remove_nodes_from_tree() -> None:
+    # 0 -> [1 -> [3, 4 -> [6]], 2 -> [5]], 1 and 4 are removed
+    child_ids = [["1", "2"], ["3", "4"], ["5"], [], ["6"], [], []]
+    parent_ids = ["-1", "0", "0", "1", "1", "2", "4"]
+    tree: list[dict[str, Any]] = [
+        {"nodeId": str(i), "parentId": parent_ids[i], "childIds": child_ids[i]}
+        for i in range(7)
+    ]
+    removed = [False, True, False, False, True, False, False]
+    remove_nodes_from_tree(
+        tree, removed, {node["nodeId"]: i for i, node in enumerate(tree)}
+    )
+    assert tree[0]["childIds"] == ["3", "6", "2"]
+    assert [tree[i]["parentId"] for i in [3, 6, 2, 5]] == ["0", "0", "0", "2"]
+    assert tree[1]["parentId"] == tree[4]["parentId"] == "[REMOVED]"
+
+
+def test_get_observation_diff() -> None:
+    prev_obs_nodes_info = {
+        "1": {"text": "RootWebArea 'Cart'"},
+        "2": {"text": "StaticText '1 item'"},
+        "3": {"text": "button 'Add to Cart'"},
+    }
+    obs_nodes_info = {
+        "1": {"text": "RootWebArea 'Cart'"},
+        "2": {"text": "StaticText '2 items'"},
+        "4": {"text": "button 'Checkout'"},
+    }
+    assert get_observation_diff(prev_obs_nodes_info, obs_nodes_info) == (
+        "- button 'Add to Cart'\n"
+        "- StaticText '1 item'\n"
+        "+ StaticText '2 items'\n"
+        "+ button 'Checkout'"
+    )
+    assert get_observation_diff(obs_nodes_info, obs_nodes_info) == ""
+
+
+class FakeCDPSession:
+    """The accessibility domain of a page whose tree is edited by the test,
+    the updates are only sent when the test emits them"""
+
+    def __init__(self, nodes: list[dict[str, Any]]) -> None:
+        self.nodes = {node["nodeId"]: node for node in nodes}
+        self.listeners: dict[str, list[Any]] = defaultdict(list)
+        self.full_fetches = 0
+
+    def on(self, event: str, handler: Any) -> None:
+        self.listeners[event].append(handler)
+
+    def remove_listener(self, event: str, handler: Any) -> None:
+        self.listeners[event].remove(handler)
+
+    def emit_updates(self, node_ids: list[str]) -> None:
+        nodes = [copy.deepcopy(self.nodes[node_id]) for node_id in node_ids]
+        for handler in self.listeners["Accessibility.nodesUpdated"]:
+            handler({"nodes": nodes})
+
+    def send(self, method: str, params: dict[str, Any]) -> dict[str, Any]:
+        if method == "Accessibility.getFullAXTree":
+            self.full_fetches += 1
+            return {"nodes": copy.deepcopy(list(self.nodes.values()))}
+        if method == "Accessibility.getChildAXNodes":
+            return {
+                "nodes": [
+                    copy.deepcopy(self.nodes[child_id])
+                    for child_id in self.nodes[params["id"]]["childIds"]
+                ]
+            }
+        return {}
+
+    def add_node(self, parent_id: str, node: dict[str, Any]) -> None:
+        self.nodes[node["nodeId"]] = node
+        self.nodes[parent_id]["childIds"].append(node["nodeId"])
+
+    def remove_node(self, parent_id: str, node_id: str) -> None:
+        self.nodes[parent_id]["childIds"].remove(node_id)
+        stack = [node_id]
+        while stack:
+            stack.extend(self.nodes.pop(stack.pop())["childIds"])
+
+    def get_browser_info(self) -> dict[str, Any]:
+        """The DOM snapshot of the page, one DOM node per accessibility
+        node"""
+        nodes = list(self.nodes.values())
+        return {
+            "DOMTree": {
+                "strings": [node["name"]["value"] for node in nodes],
+                "documents": [
+                    {
+                        "nodes": {
+                            "backendNodeId": [
+                                node["backendDOMNodeId"] for node in nodes
+                            ],
+                            "nodeValue": list(range(len(nodes))),
+                            "attributes": [[] for _ in nodes],
+                        }
+                    }
+                ],
+            },
+            "config": {},
+        }
+
+
+def test_incremental_accessibility_tree() -> None:
+    client = FakeCDPSession(
+        [
+            _ax_node("1", "RootWebArea", "Page", ["2", "5"]),
+            _ax_node("2", "list", "Cart", ["3", "4"]),
+            _ax_node("3", "listitem", "Shoes", []),
+            _ax_node("4", "listitem", "Socks", []),
+            _ax_node("5", "button", "Checkout", []),
+        ]
+    )
+    processor = TextObervationProcessor(
+        "accessibility_tree",
+        False,
+        {"width": 1280, "height": 720},
+        incremental=True,
+    )
+
+    def check_tree() -> None:
+        tree = processor.fetch_incremental_accessibility_tree(
+            client, client.get_browser_info()  # type: ignore[arg-type]
+        )
+        full_tree = client.send("Accessibility.getFullAXTree", {})["nodes"]
+        client.full_fetches -= 1
+        assert {node["nodeId"]: node for node in tree} == {
+            node["nodeId"]: node for node in full_tree
+        }
+        assert TextObervationProcessor.parse_accessibility_tree(
+            tree
+        ) == TextObervationProcessor.parse_accessibility_tree(full_tree)
+
+    check_tree()
+    assert client.full_fetches == 1
+
+    # the updates patch the cache, the new children are fetched
+    client.add_node("2", _ax_node("6", "listitem", "Hat", ["7"]))
+    client.nodes["6"]["childIds"] = []
+    client.add_node("6", _ax_node("7", "StaticText", "$5", []))
+    client.nodes["5"]["name"]["value"] = "Checkout (3)"
+    client.remove_node("2", "3")
+    client.emit_updates(["2", "5"])
+    check_tree()
+    assert client.full_fetches == 1
+
+    # the update of the new name is missed, the DOM changed without any
+    # update so the tree is fetched again
+    client.nodes["4"]["name"]["value"] = "Red socks"
+    check_tree()
+    assert client.full_fetches == 2
+
+    # the update of a removed node is missed, its DOM node is gone
+    client.remove_node("6", "7")
+    client.nodes["5"]["name"]["value"] = "Checkout (2)"
+    client.emit_updates(["5"])
+    check_tree()
+    assert client.full_fetches == 3
+
+    # the steps without any change keep the cache, up to a limit
+    for _ in range(processor.max_incremental_steps):
+        check_tree()
+    assert client.full_fetches == 3
+    check_tree()
+    assert client.full_fetches == 4
+
+    # only the client of the current page is listened to
+    other_client = FakeCDPSession([_ax_node("1", "RootWebArea", "Page", [])])
+    processor.fetch_incremental_accessibility_tree(
+        other_client,  # type: ignore[arg-type]
+        other_client.get_browser_info(),  # type: ignore[arg-type]
+    )
+    assert not any(client.listeners.values())
+    assert all(
+        len(listeners) == 1 for listeners in other_client.listeners.values()
+    )
+
+
+class AsyncFakeCDPSession(FakeCDPSession):
+    async def send(  # type: ignore[override]
+        self, method: str, params: dict[str, Any]
+    ) -> dict[str, Any]:
+        return super().send(method, params)
+
+
+def test_async_incremental_accessibility_tree() -> None:
+    client = AsyncFakeCDPSession(
+        [
+            _ax_node("1", "RootWebArea", "Page", ["2", "4"]),
+            _ax_node("2", "list", "Cart", ["3"]),
+            _ax_node("3", "listitem", "Shoes", []),
+            _ax_node("4", "button", "Checkout", []),
+        ]
+    )
+    processor = TextObervationProcessor(
+        "accessibility_tree",
+        False,
+        {"width": 1280, "height": 720},
+        incremental=True,
+    )
+
+    async def check_tree() -> None:
+        tree = await processor.afetch_incremental_accessibility_tree(
+            client, client.get_browser_info()  # type: ignore[arg-type]
+        )
+        full_tree = FakeCDPSession.send(
+            client, "Accessibility.getFullAXTree", {}
+        )["nodes"]
+        client.full_fetches -= 1
+        assert {node["nodeId"]: node for node in tree} == {
+            node["nodeId"]: node for node in full_tree
+        }
+
+    async def _test() -> None:
+        await check_tree()
+        assert client.full_fetches == 1
+
+        # the updates patch the cache, the new children are fetched
+        client.add_node("2", _ax_node("5", "listitem", "Hat", []))
+        client.nodes["4"]["name"]["value"] = "Checkout (2)"
+        client.emit_updates(["2", "4"])
+        await check_tree()
+        assert client.full_fetches == 1
+
+        # the DOM changed without any update
+        client.nodes["3"]["name"]["value"] = "Red shoes"
+        await check_tree()
+        assert client.full_fetches == 2
+
+    asyncio.run(_test())
@@ -0,0 +1,40 @@
+import argparse
+
+import pytest
+
+from browser_env.scheduler import SiteScheduler, parse_site_limit
+
+
+def test_site_scheduler() -> None:
+    scheduler = SiteScheduler({"gitlab": 2, "map": 1})
+    for idx in range(3):
+        scheduler.add(f"gitlab_{idx}", ["gitlab"])
+    scheduler.add("map_0", ["map"])
+    scheduler.add("map_1", ["map", "wikipedia"])
+    scheduler.add("wikipedia_0", ["wikipedia"])
+
+    # the backends are interleaved instead of filling up gitlab first
+    assert scheduler.next_task() == "gitlab_0"
+    assert scheduler.next_task() == "map_0"
+    assert scheduler.next_task() == "wikipedia_0"
+    assert scheduler.next_task() == "gitlab_1"
+    # gitlab and map are at their limits
+    assert scheduler.next_task() is None
+
+    scheduler.finish("map_0")
+    assert scheduler.next_task() == "map_1"
+    scheduler.finish("gitlab_0")
+    assert scheduler.next_task() == "gitlab_2"
+    assert len(scheduler) == 4
+
+
+def test_site_scheduler_invalid_limit() -> None:
+    with pytest.raises(ValueError):
+        SiteScheduler({"gitlab": 0})
+
+
+def test_parse_site_limit() -> None:
+    assert parse_site_limit("gitlab=2") == ("gitlab", 2)
+    for site_limit in ["gitlab", "=2", "gitlab=two", "gitlab=0"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_site_limit(site_limit)
@@ -11,6 +11,7 @@ from playwright.sync_api import Page
 from browser_env import (
     Action,
     AsyncScriptBrowserEnv,
+    BrowserVectorEnv,
     DetachedPage,
     ScriptBrowserEnv,
     create_focus_and_click_action,
@@ -251,3 +252,110 @@ def test_accessibility_tree_observation_update(
         )
     )
     assert "UNIQUE_NAME" in obs["text"]
+
+
+def test_reuse_browser_across_resets() -> None:
+    env = ScriptBrowserEnv(reuse_browser=True)
+    env.reset()
+    browser = env.browser
+    context = env.context
+    env.reset()
+    assert env.browser is browser
+    assert env.context is not context
+    assert context not in browser.contexts
+
+    # the browser is relaunched if it crashes
+    browser.close()
+    env.reset()
+    assert env.browser is not browser
+    assert env.is_browser_alive()
+    _, success, _, _, info = env.step(
+        create_goto_url_action("http://www.example.com")
+    )
+    assert success
+    assert info["page"].url == "http://www.example.com/"
+    env.close()
+
+
+def test_adaptive_settle() -> None:
+    env = ScriptBrowserEnv(
+        sleep_after_execution=2.0, settle_strategy="adaptive"
+    )
+    env.reset()
+    _, success, _, _, info = env.step(
+        create_goto_url_action("http://www.example.com")
+    )
+    assert success
+    assert 0.0 <= info["settle_time"] < 2.0
+    _, success, _, _, info = env.step(
+        create_focus_and_click_action(
+            element_role="link",
+            element_name="More",
+        )
+    )
+    assert success
+    assert 0.0 <= info["settle_time"] <= 2.5
+    assert info["page"].url.startswith("https://www.iana.org")
+    env.close()
+
+
+@pytest.mark.asyncio
+async def test_async_accessibility_tree_id_based_action() -> None:
+    env = AsyncScriptBrowserEnv(
+        observation_type="accessibility_tree", current_viewport_only=True
+    )
+    await env.areset()
+    obs, success, _, _, info = await env.astep(
+        create_id_based_action(
+            "goto [https://russmaxdesign.github.io/exercise/]"
+        )
+    )
+    assert success
+    assert "combobox 'Favourite mammal'" in obs["text"]
+
+    element_id = next(
+        node_id
+        for node_id, node_info in info["observation_metadata"]["text"][
+            "obs_nodes_info"
+        ].items()
+        if "textbox 'Full name'" in node_info["text"]
+    )
+    obs, success, _, _, _ = await env.astep(
+        create_id_based_action(f"type [{element_id}] [UNIQUE_NAME] [0]")
+    )
+    assert success
+    assert "UNIQUE_NAME" in obs["text"]
+    await env.aclose()
+
+
+def test_async_env_sync_api() -> None:
+    env = AsyncScriptBrowserEnv(observation_type="accessibility_tree")
+    env.reset()
+    for _ in range(2):
+        obs, success, _, _, _ = env.step(
+            create_goto_url_action("http://www.example.com")
+        )
+        assert success
+        assert "Example Domain" in obs["text"]
+    env.close()
+
+
+def test_browser_vector_env() -> None:
+    vector_env = BrowserVectorEnv(2)
+    vector_env.reset()
+    vector_env.step(
+        collate_actions([create_goto_url_action("http://www.example.com")] * 2)
+    )
+    obs, rewards, _, _, info = vector_env.step(
+        [
+            create_focus_and_click_action(
+                element_role="link", element_name="More"
+            ),
+            create_goto_url_action("https://www.rfc-editor.org"),
+        ]
+    )
+    assert rewards.tolist() == [1.0, 1.0]
+    assert len(obs["text"]) == 2
+    assert info["page"][1].url == "https://www.rfc-editor.org/"
+    assert info["page"][0].url != info["page"][1].url
+    vector_env.close()
@@ -0,0 +1,35 @@
+from llms.tokenizers import Tokenizer
+
+TEXT = (
+    "Tab 0 (current): Shopping\n"
+    "\n"
+    "[1] RootWebArea 'Shopping' focused: True\n"
+    "\t[2] link 'My Account'\n"
+    "\t\t[3] StaticText 'Welcome, the shopper!'\n"
+    "\t \n"
+    "   \n"
+    "\t[4] button 'Search'.\n"
+    "\n"
+    "\n"
+    "    indented with spaces...\n"
+    "\t[5] StaticText 'Price: $12.99'\n"
+)
+
+
+def test_truncate(cl100k_tokenizer: Tokenizer) -> None:
+    tokenizer = cl100k_tokenizer
+    ids = tokenizer.encode(TEXT)
+    # every budget, most of them end in the middle of a line
+    for max_length in range(len(ids) + 2):
+        assert tokenizer.truncate(TEXT, max_length) == tokenizer.decode(
+            ids[:max_length]
+        )
+
+
+def test_split_lines(cl100k_tokenizer: Tokenizer) -> None:
+    chunks = Tokenizer.split_lines(TEXT)
+    assert "".join(chunks) == TEXT
+    # no token spans two chunks
+    assert sum(len(cl100k_tokenizer.encode(chunk)) for chunk in chunks) == len(
+        cl100k_tokenizer.encode(TEXT)
+    )